@@ -1,13 +1,38 @@
+from raybot import config, metrics
 from raybot.model import db
 from raybot.bot import dp
-from raybot.cli import buildings, photos, test_map, missing
+from raybot.cli import (
+    buildings, photos, test_map, missing, bench, tiles, filltiles, prerender, replay, loadtest,
+    plans
+)
+from raybot.util import loopmon
 import raybot.handlers  # noqa
+import asyncio
 import logging
 import sys
 import os
 from aiogram import executor
 
 
+async def refresh_open_slots():
+    """Rebuilds opening hours bitsets when a new week starts."""
+    while True:
+        try:
+            await db.update_open_slots(stale_only=True)
+        except Exception:
+            logging.exception('Failed to refresh opening hours')
+        await asyncio.sleep(3600)
+
+
+async def startup(dp):
+    if config.METRICS_PORT:
+        await metrics.start_server(int(config.METRICS_PORT))
+    asyncio.create_task(loopmon.sample_lag())
+    asyncio.create_task(refresh_open_slots())
+    if config.DEBUG_BLOCKING_MS:
+        loopmon.BlockingDetector(config.DEBUG_BLOCKING_MS).start()
+
+
 async def shutdown(dp):
     await db.close()
 
@@ -15,7 +40,7 @@ async def shutdown(dp):
 def main():
     if len(sys.argv) < 2 or os.path.isdir(sys.argv[1]):
         logging.basicConfig(level=logging.INFO)
-        executor.start_polling(dp, skip_updates=True, on_shutdown=shutdown)
+        executor.start_polling(dp, skip_updates=True, on_startup=startup, on_shutdown=shutdown)
     else:
         cmd = sys.argv[1].lower()
         if cmd == 'buildings':
@@ -26,6 +51,20 @@ def main():
             test_map.run()
         elif cmd == 'missing':
             missing.run()
+        elif cmd == 'bench':
+            bench.run()
+        elif cmd == 'mbtiles':
+            tiles.run()
+        elif cmd == 'filltiles':
+            filltiles.run()
+        elif cmd == 'prerender':
+            prerender.run()
+        elif cmd == 'replay':
+            replay.run()
+        elif cmd == 'loadtest':
+            loadtest.run()
+        elif cmd == 'plans':
+            plans.run()
         else:
             print('Supported commands:')
             print()
@@ -33,6 +72,14 @@ def main():
             print('photos — print missing and stray photos')
             print('missing — print pois with missing important keys')
             print('map — generate a map image')
+            print('mbtiles — pack the tiles directory into an MBTiles file')
+            print('filltiles — make missing tiles from other zoom levels in advance')
+            print('prerender — render maps for all pois in advance')
+            print('bench — run a micro-benchmark for tokens, maps, distances, search, '
+                  'fallback or inline mode')
+            print('replay — replay a search log against a copy of the database')
+            print('loadtest — simulate users against a fake Bot API server')
+            print('plans — check that hot queries use indexes')
 
 
 if __name__ == '__main__':
@@ -1,13 +1,15 @@
 from raybot import config
 from raybot.model import db
+from raybot.model.normalize import get_normalizer
 from raybot.actions.poi import print_poi_by_key
 from raybot.bot import bot
-from raybot.util import has_keyword, tr
+from raybot.util import tr
 from aiogram import types
 from aiogram.utils.callback_data import CallbackData
 from aiogram.dispatcher.filters.state import State, StatesGroup
 from aiogram.dispatcher import FSMContext
-from typing import List
+from bisect import bisect_right
+from typing import List, Dict, Tuple
 
 
 HOUSE_CB = CallbackData('house', 'id')
@@ -18,25 +20,90 @@ class AddrState(StatesGroup):
     house = State()
 
 
-async def test_address(message: types.Message, tokens: List[str], state: FSMContext) -> bool:
-    if 'streets' not in config.ADDR:
-        return False
-    for street in config.ADDR['streets']:
-        if has_keyword(tokens[0], street['keywords']):
-            if len(tokens) == 1:
-                await AddrState.street.set()
-                await state.set_data({'street': street['name']})
-                await print_street(message, street)
+class AddressIndex:
+    """Lookup tables for config.ADDR, built once with get_address_index()."""
+    def __init__(self, addr: dict):
+        # keyword -> (order, street)
+        self.streets: Dict[str, Tuple[int, dict]] = {}
+        # stemmed keyword -> (order, street), for a fallback when nothing else is found
+        self.stemmed_streets: Dict[str, Tuple[int, dict]] = {}
+        # keyword + house -> (order, street, house), for buildings like "mst6"
+        self.buildings: Dict[str, Tuple[int, dict, str]] = {}
+        self.by_name: Dict[str, dict] = {}
+        # entrance -> (first apartment, sorted first apartments on floors or None)
+        self.apartments: Dict[str, Tuple[int, List[int]]] = {}
+
+        # Earlier streets win, so do not overwrite keys
+        norm = get_normalizer()
+        for i, street in enumerate(addr.get('streets', [])):
+            self.by_name.setdefault(street['name'], street)
+            for k in street['keywords']:
+                self.streets.setdefault(k, (i, street))
+                self.stemmed_streets.setdefault(norm.stem(norm.fold(k)), (i, street))
+                for house in street['buildings']:
+                    self.buildings.setdefault(k + str(house), (i, street, house))
+        for entrance, apts in addr.get('apartments', {}).items():
+            if isinstance(apts, list):
+                floors = sorted(apts)
+                self.apartments[entrance] = (floors[0], floors)
             else:
-                await handle_building(message.from_user, street, tokens[1:], state)
-            return True
-
-        # Check buildings like "mst6"
-        for house in street['buildings']:
-            if has_keyword(tokens[0], street['keywords'], str(house)):
-                await handle_building(message.from_user, street, [house] + tokens[1:], state)
-                return True
-    return False
+                self.apartments[entrance] = (apts, None)
+
+    def find_street(self, token: str, stemmed: bool = False) -> Tuple[dict, str]:
+        """Returns a street and a house number (None for just a street) for a token.
+        With stemmed, looks up a stemmed token among stemmed street keywords."""
+        if stemmed:
+            street = self.stemmed_streets.get(token)
+            return (None, None) if not street else (street[1], None)
+        street = self.streets.get(token)
+        building = self.buildings.get(token)
+        if building and (not street or building[0] < street[0]):
+            return building[1], building[2]
+        return (None, None) if not street else (street[1], None)
+
+    def find_apartment(self, entrances: List[str], apartment: int) -> Tuple[str, int]:
+        """Returns an entrance and a floor (None if unknown) for an apartment."""
+        # Among entrances with equal first apartments, the first listed wins
+        ranked = sorted((self.apartments[e][0], -i, e)
+                        for i, e in enumerate(entrances) if e in self.apartments)
+        idx = bisect_right([r[0] for r in ranked], apartment) - 1
+        if idx < 0:
+            return None, None
+        entrance = ranked[idx][2]
+        floors = self.apartments[entrance][1]
+        return entrance, None if floors is None else bisect_right(floors, apartment)
+
+
+_address_index = None
+
+
+def get_address_index() -> AddressIndex:
+    global _address_index
+    if _address_index is None:
+        _address_index = AddressIndex(config.ADDR)
+    return _address_index
+
+
+async def test_address(message: types.Message, tokens: List[str], state: FSMContext,
+                       stemmed: bool = False) -> bool:
+    """Tokens come stemmed. Streets are matched by what the user typed,
+    or with stemmed, by stemmed tokens."""
+    raw = get_normalizer().split(message.text, stem=False)
+    if len(raw) != len(tokens):
+        raw = tokens
+    street, house = get_address_index().find_street(tokens[0] if stemmed else raw[0], stemmed)
+    if not street:
+        return False
+    tokens = raw
+    if house is not None:
+        await handle_building(message.from_user, street, [house] + tokens[1:], state)
+    elif len(tokens) == 1:
+        await AddrState.street.set()
+        await state.set_data({'street': street['name']})
+        await print_street(message, street)
+    else:
+        await handle_building(message.from_user, street, tokens[1:], state)
+    return True
 
 
 async def print_street(message, street):
@@ -83,24 +150,7 @@ async def print_apartment(user: types.User, building: str, apartment):
         return
 
     entrances = [building] + await db.get_entrances(building)
-    floor = None
-    entrance = None
-    entrance_first = None
-    for e in entrances:
-        e_apts = config.ADDR['apartments'].get(e)
-        if e_apts is None:
-            continue
-        elif isinstance(e_apts, list):
-            if apartment >= e_apts[0]:
-                if entrance is None or entrance_first < e_apts[0]:
-                    entrance = e
-                    entrance_first = e_apts[0]
-                    floor = len([a for a in e_apts if a <= apartment])
-        elif apartment >= e_apts:
-            if entrance is None or entrance_first < e_apts:
-                entrance = e
-                entrance_first = e_apts
-                floor = None
+    entrance, floor = get_address_index().find_apartment(entrances, apartment)
 
     if entrance is None:
         comment = None
@@ -1,7 +1,9 @@
-from raybot import config
-from raybot.model import db, POI, Location
+from raybot import config, metrics
+from raybot.model import db, geometry, openhours, POI, Location
+from raybot.model.houses import get_house_tree
 from raybot.bot import bot
-from raybot.util import h, get_user, get_map, pack_ids, uncap, tr
+from raybot.util import h, get_user, get_map, uncap, tr, photo_catalog
+from raybot.util.results import get_result_store
 import csv
 import re
 import os
@@ -19,7 +21,7 @@ POI_LIST_CB = CallbackData('poi', 'id')
 POI_LOCATION_CB = CallbackData('poiloc', 'id')
 POI_SIMILAR_CB = CallbackData('similar', 'id')
 POI_EDIT_CB = CallbackData('poiedit', 'id', 'd')
-POI_FULL_CB = CallbackData('plst', 'query', 'ids')
+POI_FULL_CB = CallbackData('plst', 'query', 'token', 'page')
 POI_HOUSE_CB = CallbackData('poih', 'house', 'floor')
 POI_STAR_CB = CallbackData('poistar', 'id', 'action')
 REVIEW_HOUSE_CB = CallbackData('hreview', 'house')
@@ -49,24 +51,34 @@ def star_sort(star: Tuple[int, bool]):
     return 1 if star[1] else 0, grade
 
 
+@metrics.timed('print_poi_list')
 async def print_poi_list(user: types.User, query: str, pois: List[POI],
                          full: bool = False, shuffle: bool = True,
-                         relative_to: Location = None, comment: str = None):
+                         relative_to: Location = None, comment: str = None,
+                         token: str = None, page: int = 0):
+    """Stores the sorted list in the result store. Pass a token to update
+    an existing result set instead, and a page to show for a full list."""
     max_buttons = 9 if not full else 20
     location = (await get_user(user)).location or relative_to
+    is_open = dict(zip([p.id for p in pois], openhours.open_at(pois).tolist()))
     if shuffle:
         if location:
-            pois.sort(key=lambda p: location.distance(p.location))
+            pois = [pois[i] for i in geometry.nearest(location, [p.location for p in pois])]
         else:
             random.shuffle(pois)
             stars = await db.stars_for_poi_list(user.id, [p.id for p in pois])
             if stars:
                 pois.sort(key=lambda p: star_sort(stars.get(p.id)), reverse=True)
-        pois.sort(key=lambda p: bool(p.hours) and not p.hours.is_open())
+        pois.sort(key=lambda p: not is_open[p.id])
     total_count = len(pois)
-    all_ids = pack_ids([p.id for p in pois])
-    if total_count > max_buttons:
-        pois = pois[:max_buttons if full else max_buttons - 1]
+    store = get_result_store()
+    if not token or not store.update(token, [p.id for p in pois], location):
+        token = store.put(query, [p.id for p in pois], location)
+    if full:
+        page = max(0, min(page, (total_count - 1) // max_buttons))
+        pois = pois[page * max_buttons:(page + 1) * max_buttons]
+    elif total_count > max_buttons:
+        pois = pois[:max_buttons - 1]
 
     # Build the message
     content = tr('poi_list', query) + '\n'
@@ -75,13 +87,15 @@ async def print_poi_list(user: types.User, query: str, pois: List[POI],
             content += h(f'\n{i}. {poi.name} — {uncap(poi.description)}')
         else:
             content += h(f'\n{i}. {poi.name}')
-        if poi.hours and not poi.hours.is_open():
+        if not is_open[poi.id]:
             content += ' 🌒'
     if total_count > max_buttons:
         if not full:
             content += '\n\n' + tr('poi_not_full', total_count=total_count)
         else:
-            content += '\n\n' + tr('poi_too_many', total_count=total_count)
+            content += '\n\n' + tr('poi_page', first=page * max_buttons + 1,
+                                     last=page * max_buttons + len(pois),
+                                     total_count=total_count)
     if comment:
         content += '\n\n' + comment
 
@@ -95,14 +109,23 @@ async def print_poi_list(user: types.User, query: str, pois: List[POI],
         b_title = f'{i} {poi.name}'
         kbd.insert(types.InlineKeyboardButton(
             b_title, callback_data=POI_LIST_CB.new(id=poi.id)))
-    if total_count > max_buttons and not full:
+
+    def full_cb(page):
         try:
-            callback_data = POI_FULL_CB.new(query=query[:55], ids=all_ids)
+            # The query is only needed when the token has expired
+            return POI_FULL_CB.new(query=query[:25].replace(':', ' '), token=token, page=page)
         except ValueError:
             # Too long
-            callback_data = POI_FULL_CB.new(query=query[:55], ids='-')
+            return POI_FULL_CB.new(query='', token=token, page=page)
+
+    if total_count > max_buttons and not full:
         kbd.insert(types.InlineKeyboardButton(
-            f'🔽 {config.MSG["all"]} {total_count}', callback_data=callback_data))
+            f'🔽 {config.MSG["all"]} {total_count}', callback_data=full_cb(0)))
+    elif full and total_count > max_buttons:
+        if page > 0:
+            kbd.insert(types.InlineKeyboardButton('⬅️', callback_data=full_cb(page - 1)))
+        if (page + 1) * max_buttons < total_count:
+            kbd.insert(types.InlineKeyboardButton('➡️', callback_data=full_cb(page + 1)))
 
     # Make a map and send the message
     map_file = get_map([poi.location for poi in pois], ref=location)
@@ -110,7 +133,7 @@ async def print_poi_list(user: types.User, query: str, pois: List[POI],
         await bot.send_message(user.id, content, parse_mode=HTML, reply_markup=kbd)
     else:
         await bot.send_photo(
-            user.id, types.InputFile(map_file.name),
+            user.id, types.InputFile(map_file, filename=map_file.name),
             caption=content, parse_mode=HTML,
             reply_markup=kbd)
         map_file.close()
@@ -220,8 +243,8 @@ async def make_poi_keyboard(user: types.User, poi: POI):
 async def make_house_keyboard(user: types.User, poi: POI):
     if not poi.key:
         return None
-    pois = await db.get_poi_by_house(poi.key)
-    if not pois:
+    house = (await get_house_tree()).get(poi.key)
+    if not house or not house.floors:
         return None
 
     kbd = types.InlineKeyboardMarkup().add(
@@ -250,6 +273,7 @@ def log_poi(poi: POI):
         logging.warning('Failed to write log line: %s', row)
 
 
+@metrics.timed('print_poi')
 async def print_poi(user: types.User, poi: POI, comment: str = None, buttons: bool = True):
     log_poi(poi)
     chat_id = user.id
@@ -260,23 +284,17 @@ async def print_poi(user: types.User, poi: POI, comment: str = None, buttons: bo
     # Prepare photos
     photos = []
     photo_names = []
+    found = await photo_catalog.resolve([poi.photo_in, poi.photo_out])
     for photo in [poi.photo_in, poi.photo_out]:
-        if photo:
-            path = os.path.join(config.PHOTOS, photo + '.jpg')
-            if os.path.exists(path):
-                file_ids = await db.find_file_ids({photo: os.path.getsize(path)})
-                if photo in file_ids:
-                    photos.append(file_ids[photo])
-                    photo_names.append(None)
-                else:
-                    photos.append(types.InputFile(path))
-                    photo_names.append([photo, os.path.getsize(path)])
+        if photo in found:
+            photos.append(found[photo].input_file())
+            photo_names.append(None if found[photo].file_id else found[photo])
 
     # Generate a map
     location = (await get_user(user)).location
     map_file = get_map([poi.location], location)
     if map_file:
-        photos.append(types.InputFile(map_file.name))
+        photos.append(types.InputFile(map_file, filename=map_file.name))
         photo_names.append(None)
 
     # Prepare the inline keyboard
@@ -312,10 +330,10 @@ async def print_poi(user: types.User, poi: POI, comment: str = None, buttons: bo
     if isinstance(msg, list):
         file_ids = [m.photo[-1].file_id for m in msg if m.photo]
     else:
-        file_ids = [msg.photo[-1]] if msg.photo else []
+        file_ids = [msg.photo[-1].file_id] if msg.photo else []
     for i, file_id in enumerate(file_ids):
         if photo_names[i]:
-            await db.store_file_id(photo_names[i][0], photo_names[i][1], file_id)
+            await photo_catalog.store_file_id(photo_names[i], file_id)
 
 
 async def print_poi_by_key(user: types.User, poi_id: str, comment: str = None,
@@ -70,6 +70,7 @@ async def import_geojson(f):
         ?, ?, ?
     )""", values)
     await conn.commit()
+    await db.update_open_slots()
     await db.reindex()
 
 
@@ -158,6 +159,7 @@ async def import_tags(f):
             if tag not in new_tags or not new_tags[tag]:
                 new_tags[tag] = row['type'].strip()
     await conn.commit()
+    await db.notify_poi_changed(None)
 
     if not new_tags:
         return None
@@ -1,10 +1,14 @@
 from raybot import config
 from raybot.util import log
-from aiogram import Bot, Dispatcher
+from aiogram import Dispatcher
+from aiogram.bot.api import TelegramAPIServer, TELEGRAM_PRODUCTION
 from aiogram.contrib.fsm_storage.memory import MemoryStorage
 
 
-bot = Bot(token=config.TELEGRAM_TOKEN)
+bot = log.InstrumentedBot(
+    token=config.TELEGRAM_TOKEN, server=TELEGRAM_PRODUCTION if not config.TELEGRAM_API
+    else TelegramAPIServer.from_base(config.TELEGRAM_API))
 storage = MemoryStorage()
 dp = Dispatcher(bot, storage=storage)
 dp.middleware.setup(log.LoggingMiddleware())
+dp.middleware.setup(log.MetricsMiddleware())
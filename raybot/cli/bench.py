@@ -0,0 +1,232 @@
+import asyncio
+import csv
+import os
+import random
+import time
+import re
+import sqlite3
+import sys
+import timeit
+from PIL import Image
+from raybot import config, metrics
+from raybot.model import db, Location, POI, geometry
+from raybot.model.autocomplete import Autocomplete
+from raybot.model.normalize import get_normalizer, reverse_synonims
+from raybot.util.map import compose_tiles, load_tile, get_zooms, deg2num
+
+
+def read_search_log(path: str = None):
+    """Returns raw message texts from a search.log file."""
+    path = path or os.path.join(config.LOGS, 'search.log')
+    with open(path, 'r') as f:
+        return [row[1] for row in csv.reader(f, delimiter='\t') if len(row) > 1 and row[1]]
+
+
+def report(name: str, seconds: float, count: int):
+    print(f'{name:<20} {seconds * 1e6 / count:8.2f} µs per call ({count} calls)')
+
+
+def bench_tokens(corpus, repeat: int = 5):
+    synonims = reverse_synonims()
+
+    def legacy(message):
+        skip_tokens = set(config.RESP.get('skip', []))
+        s = message.strip().lower().replace('ё', 'е')
+        tokens = re.split(r'[\s,.+=!@#$%^&*()\'"«»<>/?`~|_-]+', s)
+        return [synonims.get(t, t) for t in tokens if len(t) > 0 and t not in skip_tokens]
+
+    norm = get_normalizer()
+    for name, func in (('legacy split', legacy), ('normalizer', norm.split)):
+        t = min(timeit.repeat(lambda: [func(m) for m in corpus], number=1, repeat=repeat))
+        report(name, t, len(corpus))
+
+
+def bench_basemap(repeat: int = 20):
+    tilesize = 256
+    gutter = 100
+
+    def legacy(xmin, ymin, cols, rows, zoom):
+        image = Image.new('RGBA', (cols * tilesize, rows * tilesize))
+        for x in range(xmin, xmin + cols):
+            for y in range(ymin, ymin + rows):
+                tile, _ = load_tile(zoom, x, y)
+                image.paste(tile, ((x - xmin) * tilesize, (y - ymin) * tilesize))
+        return image.crop((gutter, gutter, cols * tilesize - gutter, rows * tilesize - gutter))
+
+    zooms = get_zooms()
+    if not zooms or not config.BBOX:
+        print('Need tiles and a bbox in the config.')
+        return
+    zoom = zooms[-1]
+    cx, cy = deg2num((config.BBOX[0] + config.BBOX[2]) / 2,
+                     (config.BBOX[1] + config.BBOX[3]) / 2, zoom)
+    for cols, rows in ((1, 1), (3, 3), (5, 4)):
+        xmin, ymin = int(cx) - cols // 2, int(cy) - rows // 2
+        left, top = xmin * tilesize + gutter, ymin * tilesize + gutter
+        right = (xmin + cols) * tilesize - gutter
+        bottom = (ymin + rows) * tilesize - gutter
+        if cols == 1:
+            # Gutters would leave nothing from a single tile
+            left, top, right, bottom = left - gutter, top - gutter, right + gutter, bottom + gutter
+        print(f'{cols * rows} tiles:')
+        old_alloc = cols * rows * tilesize * tilesize * 4 + (right - left) * (bottom - top) * 4
+        new_alloc = (right - left) * (bottom - top) * 4
+        t = min(timeit.repeat(lambda: legacy(xmin, ymin, cols, rows, zoom),
+                              number=1, repeat=repeat))
+        print(f'  merge and crop: {t * 1000:7.2f} ms, {old_alloc // 1024} KB allocated')
+        t = min(timeit.repeat(lambda: compose_tiles(left, top, right, bottom, zoom),
+                              number=1, repeat=repeat))
+        print(f'  viewport:       {t * 1000:7.2f} ms, {new_alloc // 1024} KB allocated')
+
+
+def bench_distance(repeat: int = 5):
+    bbox = config.BBOX or [27.64, 53.925, 27.66, 53.935]
+    ref = Location(lon=(bbox[0] + bbox[2]) / 2, lat=(bbox[1] + bbox[3]) / 2)
+    for count in (100, 1000, 5000):
+        locations = [Location(lon=random.uniform(bbox[0], bbox[2]),
+                              lat=random.uniform(bbox[1], bbox[3])) for _ in range(count)]
+        print(f'{count} locations:')
+        t = min(timeit.repeat(
+            lambda: sorted([loc for loc in locations if ref.distance(loc) <= 500],
+                           key=lambda loc: ref.distance(loc))[:30],
+            number=1, repeat=repeat))
+        print(f'  filter and sort: {t * 1000:7.2f} ms')
+        t = min(timeit.repeat(
+            lambda: geometry.nearest(ref, locations, k=30, max_dist=500),
+            number=1, repeat=repeat))
+        print(f'  vectorised:      {t * 1000:7.2f} ms')
+
+
+def bench_search(corpus):
+    norm = get_normalizer()
+    queries = [' '.join(norm.split(m)) for m in corpus]
+    queries = [q for q in queries if q]
+
+    async def replay():
+        try:
+            for i in range(2):
+                start = time.perf_counter()
+                for q in queries:
+                    await db.find_poi(q)
+                report(f'search, pass {i + 1}', time.perf_counter() - start, len(queries))
+        finally:
+            await db.close()
+
+    asyncio.run(replay())
+    hits = metrics.get('search_cache_hits_total')
+    misses = metrics.get('search_cache_misses_total')
+    print(f'Cache hits: {hits:.0f} of {hits + misses:.0f} ({hits * 100 / (hits + misses):.1f}%), '
+          f'saved {metrics.get("search_cache_saved_seconds_total") * 1000:.1f} ms')
+
+
+def bench_fallback(path: str = None):
+    """Counts searches that find nothing with all tokens, with and without stemming."""
+    path = path or os.path.join(config.LOGS, 'search.log')
+    with open(path, 'r') as f:
+        messages = [row[1] for row in csv.reader(f, delimiter='\t')
+                    if len(row) > 3 and row[1] and row[3] not in ('predefined', 'address')]
+    norm = get_normalizer()
+    conn = sqlite3.connect(config.DATABASE)
+    rows = conn.execute("select rowid, name, keywords, tag from poi "
+                        "where in_index and delete_reason is null").fetchall()
+    conn.close()
+
+    mem = sqlite3.connect(':memory:')
+    for stem in (False, True):
+        table = 'stemmed' if stem else 'folded'
+        mem.execute(f"create virtual table {table} using fts3("
+                    "name, keywords, tag, tokenize=unicode61)")
+        for row in rows:
+            tagkw = ' '.join(config.TAGS['tags'].get(row[3], [])) or None
+            mem.execute(f"insert into {table} (docid, name, keywords, tag) values (?, ?, ?, ?)",
+                        (row[0], *(norm.index_text(v, stem) for v in (row[1], row[2], tagkw))))
+
+        fallback = 0
+        total = 0
+        for message in messages:
+            tokens = norm.split(message, stem=stem)
+            if not tokens:
+                continue
+            total += 1
+            try:
+                found = mem.execute(f"select docid from {table} where {table} match ? limit 1",
+                                    (' '.join(tokens),)).fetchone()
+            except sqlite3.OperationalError:
+                found = None
+            if not found:
+                fallback += 1
+        print(f'{"Stemmed" if stem else "Folded":<8} index: {fallback} of {total} searches '
+              f'need the fallback ({fallback * 100 / max(1, total):.1f}%)')
+
+
+def make_synthetic_pois(count: int):
+    words = sorted({w for kws in config.TAGS['tags'].values() for kw in kws for w in kw.split()})
+    syllables = ['ка', 'ро', 'ми', 'ле', 'на', 'ту', 'бо', 'ви', 'за', 'до', 'ся', 'пу']
+    names = [''.join(random.choices(syllables, k=random.randint(2, 4))) for _ in range(count // 5)]
+    bbox = config.BBOX or [27.64, 53.925, 27.66, 53.935]
+    pois = []
+    for i in range(1, count + 1):
+        poi = POI(name=f'{random.choice(words).capitalize()} {random.choice(names)}',
+                  location=Location(lon=random.uniform(bbox[0], bbox[2]),
+                                    lat=random.uniform(bbox[1], bbox[3])),
+                  keywords=' '.join(random.sample(words, 3)))
+        poi.id = i
+        pois.append(poi)
+    return pois
+
+
+def percentiles(values):
+    values = sorted(values)
+    return ', '.join(f'p{p} {values[min(len(values) - 1, len(values) * p // 100)] * 1e6:.0f} µs'
+                     for p in (50, 90, 99))
+
+
+def bench_inline(count: int = 100000):
+    pois = make_synthetic_pois(count)
+    ac = Autocomplete()
+    start = time.perf_counter()
+    for poi in pois:
+        ac.add(poi)
+    print(f'Built a trie for {count} pois in {time.perf_counter() - start:.1f} s')
+    ac.stars = {random.randint(1, count): random.randint(1, 20) for _ in range(count // 10)}
+
+    for cached in (False, True):
+        timings = []
+        for poi in random.sample(pois, 200):
+            query = poi.name.lower()
+            for i in range(1, len(query) + 1):
+                t = time.perf_counter()
+                ac.search(query[:i])
+                timings.append(time.perf_counter() - t)
+        print(f'Typing, {"warm" if cached else "cold"}: {percentiles(timings)}')
+
+    timings = []
+    for poi in random.sample(pois, 200):
+        t = time.perf_counter()
+        ac.update(poi.id, poi)
+        timings.append(time.perf_counter() - t)
+    print(f'Updating a poi: {percentiles(timings)}')
+
+
+def run():
+    if len(sys.argv) < 3:
+        print('Usage: {} bench <tokens|basemap|distance|search|fallback|inline> '
+              '[<search.log>]'.format(sys.argv[0]))
+        sys.exit(1)
+    what = sys.argv[2]
+    if what == 'tokens':
+        corpus = read_search_log(None if len(sys.argv) < 4 else sys.argv[3])
+        bench_tokens(corpus)
+    elif what == 'basemap':
+        bench_basemap()
+    elif what == 'distance':
+        bench_distance()
+    elif what == 'inline':
+        bench_inline()
+    elif what == 'search':
+        bench_search(read_search_log(None if len(sys.argv) < 4 else sys.argv[3]))
+    elif what == 'fallback':
+        bench_fallback(None if len(sys.argv) < 4 else sys.argv[3])
+    else:
+        print(f'Unknown benchmark: {what}')
+        sys.exit(1)
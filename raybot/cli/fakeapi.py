@@ -0,0 +1,157 @@
+"""A local stand-in for the Telegram Bot API, for load testing without Telegram.
+Updates are pushed with push_update(), and replies to a chat can be awaited."""
+import asyncio
+import json
+import time
+from aiohttp import web
+from io import BytesIO
+from PIL import Image
+from typing import Dict, List
+
+
+BOT_USER = {'id': 1000000, 'is_bot': True, 'first_name': 'Raybot', 'username': 'raybot'}
+
+
+class FakeBotAPI:
+    def __init__(self):
+        self.updates: List[dict] = []
+        self.update_id = 0
+        self.message_id = 0
+        self.has_updates = asyncio.Event()
+        self.pushed: Dict[int, float] = {}  # update_id -> time it was pushed
+        self.queue_wait: List[float] = []  # seconds between pushing and getUpdates
+        self.calls: Dict[str, int] = {}
+        self.waiters: Dict[int, asyncio.Future] = {}  # chat id -> future for the next reply
+        self.keyboards: Dict[int, dict] = {}  # chat id -> last message with inline buttons
+        self.callback_chats: Dict[str, int] = {}  # callback query id -> chat id
+        self.photo = self.make_photo()
+        self.runner: web.AppRunner = None
+
+    @staticmethod
+    def make_photo() -> bytes:
+        buf = BytesIO()
+        Image.new('RGB', (64, 64), (200, 200, 200)).save(buf, 'JPEG')
+        return buf.getvalue()
+
+    async def start(self, host: str = 'localhost', port: int = 0) -> str:
+        """Starts the server and returns the base URL for TelegramAPIServer.from_base()."""
+        app = web.Application()
+        app.router.add_post('/bot{token}/{method}', self.handle)
+        app.router.add_get('/file/bot{token}/{path:.+}', self.handle_file)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return f'http://{host}:{port}'
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+
+    def push_update(self, update: dict) -> int:
+        self.update_id += 1
+        update['update_id'] = self.update_id
+        if 'callback_query' in update:
+            cq = update['callback_query']
+            self.callback_chats[cq['id']] = cq['message']['chat']['id']
+        self.updates.append(update)
+        self.pushed[self.update_id] = time.perf_counter()
+        self.has_updates.set()
+        return self.update_id
+
+    def expect_reply(self, chat_id: int) -> asyncio.Future:
+        """Returns a future resolved with a method name on the next reply to the chat."""
+        fut = asyncio.get_running_loop().create_future()
+        self.waiters[chat_id] = fut
+        return fut
+
+    def _notify(self, chat_id: int, method: str):
+        fut = self.waiters.pop(chat_id, None)
+        if fut and not fut.done():
+            fut.set_result(method)
+
+    def make_message(self, chat_id: int, fields: dict, photo: bool = False) -> dict:
+        self.message_id += 1
+        msg = {
+            'message_id': self.message_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': BOT_USER,
+        }
+        for k in ('text', 'caption'):
+            if k in fields:
+                msg[k] = fields[k]
+        if photo:
+            msg['photo'] = [{'file_id': f'photo{self.message_id}',
+                             'file_unique_id': f'u{self.message_id}',
+                             'width': 64, 'height': 64}]
+        if 'latitude' in fields:
+            msg['location'] = {'latitude': float(fields['latitude']),
+                               'longitude': float(fields['longitude'])}
+        markup = json.loads(fields['reply_markup']) if 'reply_markup' in fields else None
+        if markup and 'inline_keyboard' in markup:
+            msg['reply_markup'] = markup
+            self.keyboards[chat_id] = msg
+        return msg
+
+    async def get_updates(self, fields: dict) -> List[dict]:
+        offset = int(fields.get('offset') or 0)
+        timeout = float(fields.get('timeout') or 0)
+        limit = int(fields.get('limit') or 100)
+        self.updates = [u for u in self.updates if u['update_id'] >= offset]
+        if not self.updates and timeout:
+            self.has_updates.clear()
+            try:
+                await asyncio.wait_for(self.has_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        result = self.updates[:limit]
+        now = time.perf_counter()
+        for u in result:
+            pushed = self.pushed.pop(u['update_id'], None)
+            if pushed is not None:
+                self.queue_wait.append(now - pushed)
+        return result
+
+    async def call(self, method: str, fields: dict):
+        chat_id = int(fields['chat_id']) if 'chat_id' in fields else None
+        if method == 'getupdates':
+            return await self.get_updates(fields)
+        if method == 'getme':
+            return BOT_USER
+        if method in ('sendmessage', 'sendlocation', 'senddocument'):
+            result = self.make_message(chat_id, fields)
+        elif method == 'sendphoto':
+            result = self.make_message(chat_id, fields, photo=True)
+        elif method == 'sendmediagroup':
+            media = json.loads(fields['media'])
+            result = [self.make_message(chat_id, m, photo=True) for m in media]
+        elif method == 'getfile':
+            return {'file_id': fields['file_id'], 'file_unique_id': fields['file_id'],
+                    'file_size': len(self.photo), 'file_path': f'photos/{fields["file_id"]}.jpg'}
+        elif method == 'answercallbackquery':
+            chat_id = self.callback_chats.pop(fields['callback_query_id'], None)
+            result = True
+        elif method.startswith('edit'):
+            result = True if chat_id is None else self.make_message(chat_id, fields)
+        else:
+            # deleteWebhook, deleteMessage, setMyCommands and alike
+            return True
+        if chat_id is not None:
+            self._notify(chat_id, method)
+        return result
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method'].lower()
+        self.calls[method] = self.calls.get(method, 0) + 1
+        fields = {}
+        for k, v in (await request.post()).items():
+            # Uploaded files are ignored, only the fact of the upload matters
+            if isinstance(v, str):
+                fields[k] = v
+        result = await self.call(method, fields)
+        return web.json_response({'ok': True, 'result': result})
+
+    async def handle_file(self, request: web.Request) -> web.Response:
+        return web.Response(body=self.photo, content_type='image/jpeg')
@@ -0,0 +1,44 @@
+import os
+import sys
+from multiprocessing import Pool
+from raybot import config
+from raybot.util.map import deg2num
+from raybot.util.tiles import get_tile_store, SynthesizingTiles
+
+
+# Maps have gutters of up to 300 pixels around the bounding box
+MARGIN = 2
+
+
+def fill_tile(args):
+    """Returns 1 if a missing tile was made, 0 if it existed or could not be made."""
+    zoom, x, y = args
+    store = get_tile_store()
+    if store.store.get_tile(zoom, x, y) or store.cache.get_tile(zoom, x, y):
+        return 0
+    return 1 if store.get_tile(zoom, x, y) else 0
+
+
+def iter_bbox_tiles(bbox, zooms):
+    for zoom in zooms:
+        xmin, ymax = deg2num(bbox[0], bbox[1], zoom)
+        xmax, ymin = deg2num(bbox[2], bbox[3], zoom)
+        for x in range(int(xmin) - MARGIN, int(xmax) + MARGIN + 1):
+            for y in range(int(ymin) - MARGIN, int(ymax) + MARGIN + 1):
+                yield zoom, x, y
+
+
+def run():
+    if not config.BBOX:
+        print('Please set bbox in the config.')
+        sys.exit(1)
+    store = get_tile_store()
+    if not isinstance(store, SynthesizingTiles):
+        print('Please set tile_cache in the config.')
+        sys.exit(1)
+    zooms = store.get_zooms()
+    processes = None if len(sys.argv) < 3 else int(sys.argv[2])
+    tiles = list(iter_bbox_tiles(config.BBOX, zooms))
+    with Pool(processes or os.cpu_count()) as pool:
+        made = sum(pool.imap_unordered(fill_tile, tiles, chunksize=64))
+    print(f'Checked {len(tiles)} tiles, made {made} missing ones in {config.TILE_CACHE}.')
@@ -0,0 +1,171 @@
+"""Runs the bot against a fake Bot API server, with simulated users
+sending searches, button taps and locations, and reports the timings."""
+from raybot import config
+from raybot.bot import bot, dp
+from raybot.model import db
+from raybot.cli.fakeapi import FakeBotAPI
+from raybot.cli.replay import snapshot_database
+from raybot.util import loopmon
+from aiogram.bot.api import TelegramAPIServer
+import asyncio
+import csv
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from typing import Tuple
+
+
+FIRST_USER_ID = 100000
+REPLY_TIMEOUT = 10
+# Weights for user actions; taps fall back to searches without a keyboard
+ACTIONS = {'search': 6, 'tap': 3, 'location': 1}
+
+
+def percentiles(values, unit: str = 'ms', scale: float = 1000) -> str:
+    if not values:
+        return 'no data'
+    values = sorted(values)
+    result = [f'p{p} {values[min(len(values) - 1, len(values) * p // 100)] * scale:.1f}'
+              for p in (50, 90, 99)]
+    return ', '.join(result) + f', max {values[-1] * scale:.1f} {unit}'
+
+
+def read_queries():
+    """Returns search log messages, or tag keywords if there is no log."""
+    path = os.path.join(config.LOGS, 'search.log')
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            queries = [row[1] for row in csv.reader(f, delimiter='\t')
+                       if len(row) > 1 and row[1]]
+        if queries:
+            return queries
+    return [kw for kws in config.TAGS['tags'].values() for kw in kws]
+
+
+class LoadDriver:
+    def __init__(self, api: FakeBotAPI, users: int, queries):
+        self.api = api
+        self.users = users
+        self.queries = queries
+        self.latencies = {k: [] for k in ACTIONS}
+        self.no_reply = 0
+        self.lag = []
+        self.message_id = 0
+        self.bbox = config.BBOX or [27.64, 53.925, 27.66, 53.935]
+
+    def make_message(self, user_id: int, **kwargs) -> dict:
+        self.message_id += 1
+        user = {'id': user_id, 'is_bot': False, 'first_name': f'User {user_id}'}
+        return {'message': {
+            'message_id': self.message_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': user,
+            **kwargs
+        }}
+
+    def make_update(self, user_id: int, action: str) -> Tuple[str, dict]:
+        """Returns the action, which can change from "tap" when there are no buttons,
+        and an update for it."""
+        if action == 'tap':
+            msg = self.api.keyboards.get(user_id)
+            buttons = [b for row in msg['reply_markup']['inline_keyboard'] for b in row
+                       if 'callback_data' in b] if msg else None
+            if buttons:
+                return action, {'callback_query': {
+                    'id': f'{user_id}-{self.message_id}',
+                    'from': {'id': user_id, 'is_bot': False, 'first_name': f'User {user_id}'},
+                    'message': msg,
+                    'chat_instance': str(user_id),
+                    'data': random.choice(buttons)['callback_data'],
+                }}
+            action = 'search'
+        if action == 'location':
+            return action, self.make_message(user_id, location={
+                'longitude': random.uniform(self.bbox[0], self.bbox[2]),
+                'latitude': random.uniform(self.bbox[1], self.bbox[3]),
+            })
+        return action, self.make_message(user_id, text=random.choice(self.queries))
+
+    async def user(self, user_id: int, deadline: float):
+        actions = list(ACTIONS)
+        weights = list(ACTIONS.values())
+        while time.perf_counter() < deadline:
+            action, update = self.make_update(user_id, random.choices(actions, weights)[0])
+            reply = self.api.expect_reply(user_id)
+            start = time.perf_counter()
+            self.api.push_update(update)
+            try:
+                await asyncio.wait_for(reply, REPLY_TIMEOUT)
+                self.latencies[action].append(time.perf_counter() - start)
+            except asyncio.TimeoutError:
+                self.no_reply += 1
+                # Do not take the late reply for an answer to the next update
+                await asyncio.sleep(1)
+
+    async def run(self, seconds: float):
+        deadline = time.perf_counter() + seconds
+        sampler = asyncio.create_task(loopmon.sample_lag(0.05, self.lag))
+        detector = None
+        if config.DEBUG_BLOCKING_MS:
+            detector = loopmon.BlockingDetector(config.DEBUG_BLOCKING_MS)
+            detector.start()
+        try:
+            await asyncio.gather(
+                *[self.user(FIRST_USER_ID + i, deadline) for i in range(self.users)])
+        finally:
+            sampler.cancel()
+            if detector:
+                detector.stop()
+
+
+async def load_test(users: int, seconds: float, queries):
+    api = FakeBotAPI()
+    url = await api.start()
+    bot.server = TelegramAPIServer.from_base(url)
+    driver = LoadDriver(api, users, queries)
+    polling = asyncio.create_task(dp.start_polling(timeout=1, relax=0))
+    try:
+        start = time.perf_counter()
+        await driver.run(seconds)
+        elapsed = time.perf_counter() - start
+    finally:
+        dp.stop_polling()
+        polling.cancel()
+        await asyncio.gather(polling, return_exceptions=True)
+        await (await bot.get_session()).close()
+        await api.stop()
+        await db.close()
+
+    answered = sum(len(v) for v in driver.latencies.values())
+    print(f'{users} users, {elapsed:.1f} s: {answered} updates answered '
+          f'({answered / elapsed:.1f} per second), {driver.no_reply} without a reply')
+    for action, values in driver.latencies.items():
+        print(f'  {action:<9} {len(values):6}: {percentiles(values)}')
+    print(f'Waiting for getUpdates: {percentiles(api.queue_wait)}')
+    print(f'Event loop lag: {percentiles(driver.lag)}')
+    print('Bot API calls: ' + ', '.join(
+        f'{k} {v}' for k, v in sorted(api.calls.items(), key=lambda kv: -kv[1])))
+
+
+def run():
+    if len(sys.argv) > 2 and not sys.argv[2].isdecimal():
+        print('Usage: {} loadtest [<users> [<seconds>]]'.format(sys.argv[0]))
+        sys.exit(1)
+    users = 10 if len(sys.argv) < 3 else int(sys.argv[2])
+    seconds = 30 if len(sys.argv) < 4 else float(sys.argv[3])
+
+    logging.basicConfig(level=logging.WARNING)
+    queries = read_queries()
+    # Keep the database and the logs intact
+    config.DATABASE = snapshot_database(config.DATABASE)
+    config.LOGS = tempfile.mkdtemp(prefix='raybot-logs-')
+    try:
+        asyncio.run(load_test(users, seconds, queries))
+    finally:
+        shutil.rmtree(os.path.dirname(config.DATABASE))
+        shutil.rmtree(config.LOGS)
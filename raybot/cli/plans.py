@@ -0,0 +1,71 @@
+"""Checks that hot queries use indexes: runs them on a copy of the database,
+prints their plans and exits with an error on full table scans."""
+from raybot import config
+from raybot.model import db
+from raybot.cli.replay import snapshot_database
+import asyncio
+import os
+import shutil
+import sys
+
+
+# Query name -> a call that executes it with typical arguments
+HOT_QUERIES = {
+    'get_poi_by_house': [
+        lambda: db.get_poi_by_house('mst1'),
+        lambda: db.get_poi_by_house('mst1', '1'),
+        lambda: db.get_poi_by_house('mst1', '-'),
+    ],
+    'get_poi_by_tag': [lambda: db.get_poi_by_tag('entrance')],
+    'get_next_unchecked': [lambda: db.get_next_unchecked()],
+    'find_file_ids': [lambda: db.find_file_ids({'photo.jpg': 1000, 'other.jpg': 2000})],
+    'count_stars': [lambda: db.count_stars(1, 1)],
+    'get_queue': [lambda: db.get_queue(10)],
+}
+
+
+async def check_plans() -> bool:
+    conn = await db.get_db()
+    db.captured_queries = []
+    for calls in HOT_QUERIES.values():
+        for call in calls:
+            await call()
+    captured = db.captured_queries
+    db.captured_queries = None
+
+    ok = True
+    checked = set()
+    for name, sql, params in captured:
+        if name not in HOT_QUERIES:
+            continue
+        checked.add(name)
+        cursor = await conn.execute(f'explain query plan {sql}', params)
+        plan = [r[3] async for r in cursor]
+        scans = db.full_scans(plan)
+        print(f'{"FAIL" if scans else "ok":<4} {name}: {" ".join(sql.split())}')
+        for line in plan:
+            print(f'       {line}')
+        if scans:
+            ok = False
+    for name in HOT_QUERIES:
+        if name not in checked:
+            print(f'FAIL {name}: the query was not executed')
+            ok = False
+    return ok
+
+
+def run():
+    config.DATABASE = snapshot_database(config.DATABASE)
+
+    async def run_checks():
+        try:
+            return await check_plans()
+        finally:
+            await db.close()
+
+    try:
+        ok = asyncio.run(run_checks())
+    finally:
+        shutil.rmtree(os.path.dirname(config.DATABASE))
+    if not ok:
+        sys.exit(1)
@@ -0,0 +1,45 @@
+from raybot.util.map import cache_map, get_map_cache_path
+from raybot.model import Location
+from raybot import config
+from multiprocessing import Pool
+import os
+import sys
+import sqlite3
+import logging
+
+
+def render(coords):
+    """Returns 1 if a map was rendered, 0 if it was cached or could not be rendered."""
+    path = get_map_cache_path(coords)
+    if os.path.exists(path):
+        return 0
+    try:
+        return 1 if cache_map(coords) else 0
+    except Exception as e:
+        logging.error(f'Failed to render a map for {coords}: {e}')
+        return 0
+
+
+def read_maps():
+    """Returns a list of locations for each poi. Maps for lists are not prerendered:
+    their markers are numbered in the order shown to a user, which is shuffled."""
+    where = 'in_index and delete_reason is null and lon is not null'
+    with sqlite3.connect(config.DATABASE) as conn:
+        return [[Location(lon=row[0], lat=row[1])]
+                for row in conn.execute(f"select lon, lat from poi where {where}")]
+
+
+def run():
+    if not config.MAP_CACHE:
+        print('Please set map_cache in the config.')
+        sys.exit(1)
+    if len(sys.argv) > 2 and not sys.argv[2].isdecimal():
+        print('Usage: {} prerender [<processes>]'.format(sys.argv[0]))
+        sys.exit(1)
+    processes = None if len(sys.argv) < 3 else int(sys.argv[2])
+
+    logging.basicConfig(level=logging.INFO)
+    maps = read_maps()
+    with Pool(processes or os.cpu_count()) as pool:
+        rendered = sum(pool.imap_unordered(render, maps, chunksize=16))
+    print(f'Rendered {rendered} of {len(maps)} maps into {config.MAP_CACHE}.')
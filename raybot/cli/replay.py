@@ -0,0 +1,225 @@
+"""Replays a search.log through the message pipeline with a stubbed bot,
+against a copy of the database, and reports timings and changed outcomes."""
+from raybot import config
+from raybot.bot import bot, dp
+from raybot.model import db
+from raybot.util import split_tokens
+from raybot.actions.addr import test_address
+from raybot.handlers import default
+from aiogram import Bot, Dispatcher, types
+from collections import Counter
+import asyncio
+import csv
+import os
+import re
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+
+USER_ID = 1
+BUCKETS_MS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 1000]
+STAGES = ['split', 'predefined', 'address', 'query']
+MAX_EXAMPLES = 20
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.values = []
+
+    def add(self, value):
+        self.values.append(value)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                return
+        self.counts[-1] += 1
+
+    def percentile(self, p: int):
+        values = sorted(self.values)
+        return values[min(len(values) - 1, len(values) * p // 100)]
+
+    def print(self, title: str, unit: str):
+        if not self.values:
+            print(f'{title}: no data')
+            return
+        print(f'{title}: {len(self.values)} calls, ' + ', '.join(
+            f'p{p} {self.percentile(p):.2f}{unit}' for p in (50, 90, 99)))
+        top = max(self.counts)
+        labels = [f'≤ {b}' for b in self.buckets] + [f'> {self.buckets[-1]}']
+        for label, count in zip(labels, self.counts):
+            if count:
+                print(f'  {label:>8}{unit} {count:7} {"#" * max(1, count * 40 // top)}')
+
+
+class StubBot:
+    """Answers Bot API requests without a network, counting calls by method."""
+    def __init__(self):
+        self.calls = Counter()
+        self.message_id = 0
+
+    def make_message(self, data: dict) -> dict:
+        self.message_id += 1
+        return {
+            'message_id': self.message_id,
+            'date': int(time.time()),
+            'chat': {'id': data.get('chat_id', USER_ID), 'type': 'private'},
+            'photo': [{'file_id': f'replay{self.message_id}', 'file_unique_id': 'replay',
+                       'width': 1, 'height': 1}],
+        }
+
+    async def request(self, method, data=None, files=None, **kwargs):
+        self.calls[method] += 1
+        data = data or {}
+        if method == 'sendMediaGroup':
+            return [self.make_message(data) for _ in range(len(files or {}) or 1)]
+        if method.startswith('send') or method.startswith('edit'):
+            return self.make_message(data)
+        return True
+
+
+def outcome_kind(outcome: str) -> str:
+    if re.match(r'^poi \d+$', outcome):
+        return 'poi'
+    if re.match(r'^\d+ results$', outcome):
+        return 'results'
+    return outcome
+
+
+def snapshot_database(path: str) -> str:
+    """Copies the database into a temporary file, so that the replay does not modify it."""
+    tmpdir = tempfile.mkdtemp(prefix='raybot-replay-')
+    target = os.path.join(tmpdir, 'raybot.sqlite')
+    with sqlite3.connect(path) as src, sqlite3.connect(target) as dst:
+        src.backup(dst)
+    return target
+
+
+def read_log(path: str):
+    """Yields (message text, logged outcome)."""
+    with open(path, 'r') as f:
+        for row in csv.reader(f, delimiter='\t'):
+            if len(row) > 3 and row[1]:
+                yield row[1], row[3]
+
+
+async def replay(path: str):
+    stub = StubBot()
+    bot.request = stub.request
+    Bot.set_current(bot)
+    Dispatcher.set_current(dp)
+    conn = await db.get_db()
+
+    queries = 0
+    orig_execute = conn.execute
+    orig_executemany = conn.executemany
+
+    def count_execute(*args, **kwargs):
+        nonlocal queries
+        queries += 1
+        return orig_execute(*args, **kwargs)
+
+    def count_executemany(*args, **kwargs):
+        nonlocal queries
+        queries += 1
+        return orig_executemany(*args, **kwargs)
+
+    conn.execute = count_execute
+    conn.executemany = count_executemany
+
+    outcome = None
+
+    def record_outcome(message, tokens, result):
+        nonlocal outcome
+        outcome = result
+
+    default.write_search_log = record_outcome
+
+    timings = {stage: Histogram(BUCKETS_MS) for stage in STAGES}
+    total = Histogram(BUCKETS_MS)
+    query_counts = Histogram(list(range(10)))
+    transitions = Counter()
+    examples = []
+    user = types.User(id=USER_ID, is_bot=False, first_name='Replay')
+    chat = types.Chat(id=USER_ID, type='private')
+    types.User.set_current(user)
+    types.Chat.set_current(chat)
+    state = dp.current_state(chat=USER_ID, user=USER_ID)
+
+    for i, (text, logged) in enumerate(read_log(path)):
+        message = types.Message(message_id=i + 1, date=int(time.time()), text=text,
+                                chat=chat.to_python(), **{'from': user.to_python()})
+        queries = 0
+        outcome = None
+        start = time.perf_counter()
+
+        t = time.perf_counter()
+        tokens = split_tokens(text)
+        timings['split'].add((time.perf_counter() - t) * 1000)
+        if not tokens:
+            outcome = 'empty'
+        else:
+            await state.finish()
+            t = time.perf_counter()
+            found = await default.test_predefined(message, tokens)
+            timings['predefined'].add((time.perf_counter() - t) * 1000)
+            if found:
+                outcome = 'predefined'
+            else:
+                t = time.perf_counter()
+                found = await test_address(message, tokens, state)
+                timings['address'].add((time.perf_counter() - t) * 1000)
+                if found:
+                    outcome = 'address'
+                else:
+                    t = time.perf_counter()
+                    await default.process_query(message, state, tokens)
+                    timings['query'].add((time.perf_counter() - t) * 1000)
+
+        total.add((time.perf_counter() - start) * 1000)
+        query_counts.add(queries)
+        if outcome != logged:
+            transitions[(outcome_kind(logged), outcome_kind(outcome))] += 1
+            if len(examples) < MAX_EXAMPLES:
+                examples.append((text, logged, outcome))
+
+    for stage in STAGES:
+        timings[stage].print(f'Stage "{stage}"', ' ms')
+    total.print('Whole message', ' ms')
+    query_counts.print('Database queries per message', '')
+    print('Bot API calls: ' + ', '.join(f'{k} {v}' for k, v in stub.calls.most_common()))
+
+    changed = sum(transitions.values())
+    print(f'Changed outcomes: {changed} of {len(total.values)}')
+    for (old, new), count in transitions.most_common():
+        if old != new:
+            print(f'  {old} → {new}: {count}')
+    same_kind = sum(c for (old, new), c in transitions.items() if old == new)
+    if same_kind:
+        print(f'  same kind, different result: {same_kind}')
+    for text, logged, new in examples:
+        print(f'  "{text}": {logged} → {new}')
+
+
+def run():
+    if len(sys.argv) < 3:
+        print('Usage: {} replay <search.log> [<database>]'.format(sys.argv[0]))
+        sys.exit(1)
+    path = sys.argv[2]
+    database = config.DATABASE if len(sys.argv) < 4 else sys.argv[3]
+    config.DATABASE = snapshot_database(database)
+
+    async def run_replay():
+        try:
+            await replay(path)
+        finally:
+            await db.close()
+
+    try:
+        asyncio.run(run_replay())
+    finally:
+        shutil.rmtree(os.path.dirname(config.DATABASE))
@@ -25,6 +25,5 @@ def run():
     fp = get_map(locations)
     filename = 'test_map.jpg' if len(sys.argv) < 4 else sys.argv[3]
     with open(filename, 'wb') as f:
-        data = fp.read()
-        f.write(data)
+        f.write(fp.getbuffer())
     fp.close()
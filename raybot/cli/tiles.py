@@ -0,0 +1,19 @@
+import os
+import sys
+from raybot import config
+from raybot.util.tiles import DirectoryTiles, convert_to_mbtiles
+
+
+def run():
+    if len(sys.argv) < 3:
+        print('Usage: {} mbtiles <output.mbtiles> [<tiles_dir>]'.format(sys.argv[0]))
+        sys.exit(1)
+    source = config.TILES if len(sys.argv) < 4 else sys.argv[3]
+    if not os.path.isdir(source):
+        print(f'{source} is not a directory with tiles.')
+        sys.exit(2)
+    if os.path.exists(sys.argv[2]):
+        print(f'{sys.argv[2]} already exists.')
+        sys.exit(2)
+    count = convert_to_mbtiles(DirectoryTiles(source), sys.argv[2], config.BBOX)
+    print(f'Written {count} tiles to {sys.argv[2]}. Set "tiles" in config.yml to this file.')
@@ -4,4 +4,5 @@ from . import poi
 from . import moderate
 from . import review
 from . import messages
+from . import inline
 from . import default
@@ -1,7 +1,8 @@
-from raybot import config
 from raybot.bot import dp
 from raybot.util import split_tokens
-from raybot.actions.addr import HOUSE_CB, handle_building, print_apartment, AddrState
+from raybot.actions.addr import (
+    HOUSE_CB, handle_building, print_apartment, get_address_index, AddrState
+)
 from aiogram import types
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.handler import SkipHandler
@@ -14,9 +15,8 @@ async def process_building(message: types.Message, state: FSMContext):
     if not tokens:
         return
     street_name = (await state.get_data())['street']
-    streets = [s for s in config.ADDR['streets'] if s['name'] == street_name]
-    if streets:
-        street = streets[0]
+    street = get_address_index().by_name.get(street_name)
+    if street:
         hid = street['buildings'].get(tokens[0])
         if hid:
             await handle_building(message.from_user, street, tokens, state)
@@ -1,17 +1,51 @@
 from raybot import config
-from raybot.model import db, Location
+from raybot.model import db, openhours, Location
+from raybot.model.normalize import get_normalizer
+from raybot.model.spelling import get_speller
 from raybot.bot import dp
-from raybot.util import split_tokens, has_keyword, get_user, h, HTML, get_buttons, prune_users, tr
+from raybot.util import split_tokens, get_user, h, HTML, get_buttons, prune_users, tr
+from raybot.util import photo_catalog
 from raybot.actions.addr import test_address
 from raybot.actions.poi import PoiState, print_poi, print_poi_list
 from raybot.actions.messages import process_reply
 import os
 import csv
 import logging
+from dataclasses import dataclass
+from typing import Dict, List, Set
 from aiogram import types
 from aiogram.dispatcher import FSMContext
 
 
+@dataclass(eq=False)
+class PredefinedResponse:
+    order: int
+    resp: dict
+
+
+# Lowercased and stemmed keyword -> responses in the config order
+PREDEFINED: Dict[str, List[PredefinedResponse]] = None
+# Folded and stemmed words from "open_now" that filter results to open pois
+OPEN_WORDS: Set[str] = None
+
+
+def compile_predefined() -> Dict[str, List[PredefinedResponse]]:
+    index = {}
+    norm = get_normalizer()
+    for i, resp in enumerate(config.RESP.get('responses', [])):
+        entry = PredefinedResponse(i, resp)
+        keys = set()
+        for k in resp['keywords']:
+            # Lowercased keywords match whole messages, stemmed ones match tokens
+            keys.add(k.lower())
+            tokens = norm.split(k, process=False)
+            if ' '.join(tokens) == norm.fold(k):
+                keys.add(' '.join(norm.stem(t) for t in tokens))
+        for k in keys:
+            index.setdefault(k, []).append(entry)
+    return index
+
+
 @dp.message_handler(commands=['start'], state='*')
 async def welcome(message: types.Message, state: FSMContext):
     await state.finish()
@@ -86,8 +120,22 @@ async def process(message: types.Message, state: FSMContext):
 
 
 async def process_query(message, state, tokens):
+    global OPEN_WORDS
+    if OPEN_WORDS is None:
+        norm = get_normalizer()
+        OPEN_WORDS = {norm.stem(norm.fold(w)) for w in config.RESP.get('open_now', [])}
+    open_now = len(tokens) > 1 and any(t in OPEN_WORDS for t in tokens)
+    if open_now:
+        tokens = [t for t in tokens if t not in OPEN_WORDS]
     query = ' '.join(tokens)
     pois = await db.find_poi(query)
+    if not pois:
+        # Fix typos before dropping tokens
+        corrected = (await get_speller()).correct_tokens(tokens)
+        if corrected != tokens:
+            tokens = corrected
+            query = ' '.join(tokens)
+            pois = await db.find_poi(query)
     if not pois and len(tokens) > 2:
         # Attempt a search with one less tokens
         for ti in range(len(tokens)):
@@ -101,6 +149,8 @@ async def process_query(message, state, tokens):
             new_pois = await db.find_poi(t)
             if new_pois and (not pois or len(pois) > len(new_pois)):
                 pois = new_pois
+    if open_now:
+        pois = [p for p, o in zip(pois, openhours.open_at(pois)) if o]
 
     if len(pois) == 1:
         write_search_log(message, tokens, f'poi {pois[0].id}')
@@ -112,6 +162,8 @@ async def process_query(message, state, tokens):
         await PoiState.poi_list.set()
         await state.set_data({'query': query, 'poi': [p.id for p in pois]})
         await print_poi_list(message.from_user, message.text, pois)
+    elif await test_address(message, split_tokens(message.text), state, stemmed=True):
+        write_search_log(message, tokens, 'address')
     else:
         write_search_log(message, tokens, 'not found')
         new_kbd = types.InlineKeyboardMarkup().add(
@@ -126,41 +178,39 @@ async def process_query(message, state, tokens):
 
 
 async def test_predefined(message, tokens) -> bool:
+    global PREDEFINED
+    if PREDEFINED is None:
+        PREDEFINED = compile_predefined()
+
     all_tokens = ' '.join(tokens)
     query = message.text.lower().strip()
-    for resp in config.RESP['responses']:
-        kw = [k.lower() for k in resp['keywords']]
-        if has_keyword(all_tokens, kw) or has_keyword(query, kw):
-            if 'role' in resp:
-                user = await get_user(message.from_user)
-                if resp['role'] not in user.roles:
-                    continue
-            content = resp.get('name', '')
-            photo = None
-            if 'photo' in resp:
-                photo_path = os.path.join(config.PHOTOS, resp['photo'])
-                if os.path.exists(photo_path):
-                    file_ids = await db.find_file_ids(
-                        {resp['photo']: os.path.getsize(photo_path)})
-                    if file_ids:
-                        photo = file_ids[resp['photo']]
-                    else:
-                        photo = types.InputFile(photo_path)
-            if 'message' in resp:
-                if content:
-                    content += '\n\n'
-                content += resp['message']
-            kbd = get_buttons(resp.get('buttons'))
-
-            if photo:
-                msg = await message.answer_photo(
-                    photo, caption=content, parse_mode=HTML, reply_markup=kbd)
-                if not isinstance(photo, str):
-                    file_id = msg.photo[0].file_id
-                    await db.store_file_id(resp['photo'], os.path.getsize(photo_path), file_id)
-            else:
-                await message.answer(content, parse_mode=HTML, reply_markup=kbd)
-            return True
+    candidates = PREDEFINED.get(all_tokens, [])
+    if query != all_tokens and query in PREDEFINED:
+        candidates = sorted(set(candidates + PREDEFINED[query]), key=lambda e: e.order)
+    for entry in candidates:
+        resp = entry.resp
+        if 'role' in resp:
+            user = await get_user(message.from_user)
+            if resp['role'] not in user.roles:
+                continue
+        content = resp.get('name', '')
+        photo = None
+        if 'photo' in resp:
+            photo = (await photo_catalog.resolve([resp['photo']], ext='')).get(resp['photo'])
+        if 'message' in resp:
+            if content:
+                content += '\n\n'
+            content += resp['message']
+        kbd = get_buttons(resp.get('buttons'))
+
+        if photo:
+            msg = await message.answer_photo(
+                photo.input_file(), caption=content, parse_mode=HTML, reply_markup=kbd)
+            if not photo.file_id:
+                await photo_catalog.store_file_id(photo, msg.photo[0].file_id)
+        else:
+            await message.answer(content, parse_mode=HTML, reply_markup=kbd)
+        return True
     return False
 
 
@@ -1,7 +1,8 @@
 from raybot import config
-from raybot.model import db, POI, Location
+from raybot.model import db, geometry, POI, Location
 from raybot.bot import bot, dp
 from raybot.util import h, HTML, split_tokens, get_buttons, get_map, get_user, tr, DOW
+from raybot.util import photo_catalog
 from raybot.actions.poi import POI_EDIT_CB, POI_LIST_CB
 from raybot.actions.messages import broadcast_str, broadcast
 import re
@@ -144,7 +145,7 @@ async def new_location(message: types.Message, state: FSMContext):
 
 @dp.message_handler(state=EditState.keywords)
 async def new_keywords(message: types.Message, state: FSMContext):
-    keywords = split_tokens(message.text)
+    keywords = split_tokens(message.text, stem=False)
     if not keywords:
         await message.answer(tr(('new_poi', 'no_keywords')))
         return
@@ -316,10 +317,10 @@ async def delete_msg(source: Union[types.Message, types.CallbackQuery],
 @dp.message_handler(commands='ephoto', state=EditState.confirm)
 async def show_photos(message: types.Message, state: FSMContext):
     poi = (await state.get_data())['poi']
+    found = await photo_catalog.resolve([poi.photo_out, poi.photo_in])
     for photo, where in [(poi.photo_out, 'photo_out'), (poi.photo_in, 'photo_in')]:
         if photo:
-            path = os.path.join(config.PHOTOS, photo + '.jpg')
-            if os.path.exists(path):
+            if photo in found:
                 kbd = types.InlineKeyboardMarkup().add(
                     types.InlineKeyboardButton(
                         '🗑️ ' + tr(('editor', 'photo_del')),
@@ -328,7 +329,7 @@ async def show_photos(message: types.Message, state: FSMContext):
                         tr(('editor', 'cancel')), callback_data='cancel_attr')
                 )
                 await message.answer_photo(
-                    types.InputFile(path), caption=tr(('editor', where)), reply_markup=kbd)
+                    found[photo].input_file(), caption=tr(('editor', where)), reply_markup=kbd)
 
 
 @dp.message_handler(commands='eout', state=EditState.confirm)
@@ -340,10 +341,12 @@ async def suggest_photo_out(message: types.Message, state: FSMContext):
         await message.answer(tr(('editor', 'no_photos_around')))
         return
 
-    photo_dist = {
-        name: min(poi.location.distance(p.location) for p in pois if p.photo_out == name)
-        for name in photos
-    }
+    with_photos = [p for p in pois if p.photo_out]
+    dist = geometry.distances(poi.location.lon, poi.location.lat,
+                              *geometry.to_arrays([p.location for p in with_photos]))
+    photo_dist = {}
+    for p, d in zip(with_photos, dist.tolist()):
+        photo_dist[p.photo_out] = min(d, photo_dist.get(p.photo_out, d))
     photo_cnt = Counter(photos)
     photos = sorted(photo_cnt, key=lambda p: (int(photo_dist.get(p, 1000) / 10),
                                               100 - photo_cnt[p]))
@@ -351,14 +354,10 @@ async def suggest_photo_out(message: types.Message, state: FSMContext):
 
     kbd = types.InlineKeyboardMarkup(row_width=5)
     media = types.MediaGroup()
+    found = await photo_catalog.resolve(photos)
     for i, photo in enumerate(photos, 1):
-        path = os.path.join(config.PHOTOS, photo + '.jpg')
-        if os.path.exists(path):
-            file_ids = await db.find_file_ids({photo: os.path.getsize(path)})
-            if photo in file_ids:
-                media.attach_photo(file_ids[photo])
-            else:
-                media.attach_photo(types.InputFile(path))
+        if photo in found:
+            media.attach_photo(found[photo].input_file())
             kbd.insert(types.InlineKeyboardButton(
                 str(i), callback_data=PHOTO_CB.new(name=photo, which='out')))
     kbd.insert(types.InlineKeyboardButton(
@@ -387,10 +386,12 @@ async def upload_photo(message: types.Message, state: FSMContext):
             logging.exception('Image upload fail')
             await message.answer(tr(('editor', 'upload_fail')))
             return
-        if not os.path.exists(path):
+        photo_catalog.forget(name)
+        photo = (await photo_catalog.resolve([name])).get(name)
+        if not photo:
             await message.answer(tr(('editor', 'upload_fail')))
             return
-        await db.store_file_id(name, os.path.getsize(path), file_id)
+        await photo_catalog.store_file_id(photo, file_id)
         downloaded = True
 
     kbd = types.InlineKeyboardMarkup().add(
@@ -411,8 +412,8 @@ async def store_photo(query: types.CallbackQuery, callback_data: Dict[str, str],
                       state: FSMContext):
     poi = (await state.get_data())['poi']
     name = callback_data['name']
-    path = os.path.join(config.PHOTOS, name + '.jpg')
-    if not os.path.exists(path):
+    photo = (await photo_catalog.resolve([name])).get(name)
+    if not photo:
         await query.answer(tr(('editor', 'photo_lost')))
         return
     which = callback_data['which']
@@ -426,7 +427,8 @@ async def store_photo(query: types.CallbackQuery, callback_data: Dict[str, str],
         elif poi.photo_in == name:
             poi.photo_in = None
     elif which == 'del':
-        os.remove(path)
+        os.remove(photo.path)
+        photo_catalog.forget(name)
         await query.answer(tr(('editor', 'photo_deleted')))
     else:
         await query.answer(tr(('editor', 'photo_forgot')))
@@ -527,8 +529,8 @@ async def edit_hours(message: types.Message, state: FSMContext):
 async def edit_house(message: types.Message, state: FSMContext):
     poi = (await state.get_data())['poi']
     houses = await db.get_houses()
-    houses.sort(key=lambda h: poi.location.distance(h.location))
-    houses = houses[:3]
+    houses = [houses[i] for i in geometry.nearest(
+        poi.location, [h.location for h in houses], k=3)]
 
     # Prepare the map
     map_file = get_map([h.location for h in houses], ref=poi.location)
@@ -544,7 +546,7 @@ async def edit_house(message: types.Message, state: FSMContext):
     # Finally send the reply
     await delete_msg(message, state)
     if map_file:
-        await message.answer_photo(types.InputFile(map_file.name),
+        await message.answer_photo(types.InputFile(map_file, filename=map_file.name),
                                    caption=tr(('editor', 'house')), reply_markup=kbd)
         map_file.close()
     else:
@@ -805,7 +807,7 @@ async def store_attr(message: types.Message, state: FSMContext):
                 return
             poi.tag = '='.join(parts)
     elif attr == 'keywords':
-        new_kw = split_tokens(value)
+        new_kw = split_tokens(value, stem=False)
         if new_kw:
             old_kw = [] if not poi.keywords else poi.keywords.split()
             poi.keywords = ' '.join(old_kw + new_kw)
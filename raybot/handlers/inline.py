@@ -0,0 +1,19 @@
+from raybot.bot import dp
+from raybot.model.autocomplete import get_autocomplete
+from raybot.actions.poi import describe_poi, HTML
+from aiogram import types
+
+
+@dp.inline_handler()
+async def inline_search(query: types.InlineQuery):
+    pois = (await get_autocomplete()).search(query.query) if query.query.strip() else []
+    results = [
+        types.InlineQueryResultArticle(
+            id=str(poi.id),
+            title=poi.name,
+            description=poi.description or poi.address_part,
+            input_message_content=types.InputTextMessageContent(
+                describe_poi(poi), parse_mode=HTML, disable_web_page_preview=True),
+        ) for poi in pois
+    ]
+    await query.answer(results, cache_time=300)
@@ -1,17 +1,15 @@
 import os
-import hashlib
 from collections import defaultdict
 from io import StringIO
 from datetime import datetime
 from tempfile import TemporaryDirectory
-from PIL import Image
 from raybot import config
 from raybot.model import db
 from raybot.bot import bot, dp
-from raybot.util import h, HTML, get_user, forget_user, tr
+from raybot.util import h, HTML, get_user, forget_user, tr, photo_catalog, profiler, fingerprint
 from raybot.actions import transfer
 from raybot.actions.poi import print_poi, POI_EDIT_CB, print_poi_list, PoiState
-from typing import Dict
+from typing import Dict, List, Tuple
 from aiogram import types
 from aiogram.utils.callback_data import CallbackData
 from aiogram.utils.exceptions import TelegramAPIError
@@ -24,6 +22,10 @@ MSG_CB = CallbackData('qmsg', 'action', 'id')
 POI_VALIDATE_CB = CallbackData('qpoi', 'id')
 MOD_REMOVE_CB = CallbackData('modrm', 'id')
 ADMIN_CB = CallbackData('admin', 'action')
+# Action -> seconds to profile for
+PROFILE_ACTIONS = {'prof-10': 10, 'prof-60': 60, 'mem-60': 60}
+# Groups of near-duplicate photos to list after deduplication
+MAX_SIMILAR = 30
 
 
 class ModState(StatesGroup):
@@ -101,9 +103,7 @@ async def print_next_queued(user: types.User):
         content += f'\n<b>{tr(("queue", "old"))}:</b> {vold}'
         content += f'\n<b>{tr(("queue", "new"))}:</b> {vnew}'
         if q.field in ('photo_in', 'photo_out') and q.new_value:
-            photo = os.path.join(config.PHOTOS, q.new_value + '.jpg')
-            if not os.path.exists(photo):
-                photo = None
+            photo = (await photo_catalog.resolve([q.new_value])).get(q.new_value)
 
     kbd = types.InlineKeyboardMarkup(row_width=3)
     if q.field != 'message':
@@ -126,7 +126,7 @@ async def print_next_queued(user: types.User):
     if not photo:
         await bot.send_message(user.id, content, parse_mode=HTML, reply_markup=kbd)
     else:
-        await bot.send_photo(user.id, types.InputFile(photo), caption=content,
+        await bot.send_photo(user.id, photo.input_file(), caption=content,
                              parse_mode=HTML, reply_markup=kbd)
     return True
 
@@ -254,17 +254,9 @@ async def print_audit(user: types.User):
     await bot.send_message(user.id, content, disable_web_page_preview=True)
 
 
-async def dedup_photos():
-    def hashall(photos):
-        result = defaultdict(list)
-        for photo in photos:
-            path = os.path.join(config.PHOTOS, photo + '.jpg')
-            image = Image.open(path)
-            h = hashlib.md5()
-            h.update(image.tobytes())
-            result[h.digest()].append(photo)
-        return result
-
+async def dedup_photos() -> Tuple[int, List[List[str]]]:
+    """Removes photos with identical pixels and returns their number,
+    and groups of remaining photos that look nearly the same."""
     conn = await db.get_db()
     cursor = await conn.execute("select id, photo_out, photo_in from poi order by id")
     photos = set()
@@ -275,17 +267,14 @@ async def dedup_photos():
                 photos.add(row[i])
                 refs[(row[i], i)] = row['id']
 
-    # Find sizes
-    sizes = defaultdict(list)
-    for photo in photos:
-        path = os.path.join(config.PHOTOS, photo + '.jpg')
-        if os.path.exists(path):
-            sizes[os.path.getsize(path)].append(photo)
+    prints = await fingerprint.fingerprint(sorted(photos))
+    hashes = defaultdict(list)
+    for photo, fp in prints.items():
+        hashes[fp.md5].append(photo)
 
     # Remove duplicates
-    removed = 0
-    hashes = hashall(sum(sizes.values(), []))
-    for s, ph in hashes.items():
+    removed = []
+    for ph in hashes.values():
         if len(ph) > 1:
             for k in ('photo_out', 'photo_in'):
                 ids = [refs[p, k] for p in ph[1:] if (p, k) in refs]
@@ -294,9 +283,14 @@ async def dedup_photos():
             for photo in ph[1:]:
                 path = os.path.join(config.PHOTOS, photo + '.jpg')
                 os.remove(path)
-                removed += 1
+                photo_catalog.forget(photo)
+                del prints[photo]
+                removed.append(photo)
     await conn.commit()
-    return removed
+    if removed:
+        await db.delete_photo_hashes(removed)
+    await db.notify_poi_changed(None)
+    return len(removed), fingerprint.near_duplicates(prints)
 
 
 async def delete_unused_photos():
@@ -319,9 +313,27 @@ async def delete_unused_photos():
     for name in photos:
         path = os.path.join(config.PHOTOS, name + '.jpg')
         os.remove(path)
+        photo_catalog.forget(name)
+    await db.delete_photo_hashes(list(photos))
     return len(photos)
 
 
+async def send_profile(user_id: int, action: str):
+    seconds = PROFILE_ACTIONS[action]
+    date = datetime.now().strftime('%y%m%d-%H%M')
+    if action.startswith('prof'):
+        dump, report = await profiler.profile_cpu(seconds)
+        await bot.send_document(
+            user_id, types.InputFile(report, filename=f'profile-{date}.txt'))
+        await bot.send_document(
+            user_id, types.InputFile(dump, filename=f'profile-{date}.prof'),
+            caption=tr(('admin_profile', 'pstats')))
+    else:
+        report = await profiler.memory_diff(seconds)
+        await bot.send_document(
+            user_id, types.InputFile(report, filename=f'memory-{date}.txt'))
+
+
 @dp.message_handler(state=ModState.admin_upload, content_types=types.ContentType.DOCUMENT)
 async def upload_document(message: types.Message, state: FSMContext):
     tmp_dir = TemporaryDirectory(prefix='raybot')
@@ -382,6 +394,8 @@ async def admin_info(message: types.Message):
                                               callback_data=ADMIN_CB.new(action='unused')))
         kbd.insert(types.InlineKeyboardButton(tr(('admin_menu', 'base')),
                                               callback_data=ADMIN_CB.new(action='base')))
+        kbd.insert(types.InlineKeyboardButton(tr(('admin_menu', 'profile')),
+                                              callback_data=ADMIN_CB.new(action='profile')))
     kbd.insert(types.InlineKeyboardButton(tr(('admin_menu', 'audit')),
                                           callback_data=ADMIN_CB.new(action='audit')))
     kbd.insert(types.InlineKeyboardButton(tr(('admin_menu', 'reindex')),
@@ -418,8 +432,13 @@ async def admin_command(query: types.CallbackQuery, callback_data: Dict[str, str
         await db.reindex()
         await bot.send_message(user.id, tr(('admin_menu', 'reindexed')))
     elif action == 'dedup' and user.id == config.ADMIN:
-        cnt = await dedup_photos()
+        await query.answer(tr(('admin_menu', 'dedup_started')))
+        cnt, similar = await dedup_photos()
         await bot.send_message(query.from_user.id, tr(('admin_menu', 'deduped'), cnt))
+        if similar:
+            lines = [', '.join(group) for group in similar[:MAX_SIMILAR]]
+            await bot.send_message(query.from_user.id,
+                                   tr(('admin_menu', 'similar'), '\n'.join(lines)))
     elif action == 'unused' and user.id == config.ADMIN:
         cnt = await delete_unused_photos()
         await bot.send_message(query.from_user.id, tr(('admin_menu', 'del_unused'), cnt))
@@ -472,6 +491,19 @@ async def admin_command(query: types.CallbackQuery, callback_data: Dict[str, str
         await bot.send_document(query.from_user.id, doc, caption=caption)
         config.MAINTENANCE = True
         f.close()
+    elif action == 'profile' and user.id == config.ADMIN:
+        kbd = types.InlineKeyboardMarkup(row_width=1)
+        for k in PROFILE_ACTIONS:
+            kbd.insert(types.InlineKeyboardButton(
+                tr(('admin_profile', k)), callback_data=ADMIN_CB.new(action=k)))
+        await bot.edit_message_reply_markup(
+            query.from_user.id, query.message.message_id, reply_markup=kbd)
+    elif action in PROFILE_ACTIONS and user.id == config.ADMIN:
+        await query.answer(tr(('admin_profile', 'started'), PROFILE_ACTIONS[action]))
+        try:
+            await send_profile(user.id, action)
+        except profiler.ProfilerBusy:
+            await bot.send_message(user.id, tr(('admin_profile', 'busy')))
     elif action == 'maintenance' and user.id == config.ADMIN:
         config.MAINTENANCE = not config.MAINTENANCE
         if config.MAINTENANCE:
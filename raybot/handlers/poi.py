@@ -5,8 +5,12 @@ from raybot.actions.poi import (
     POI_HOUSE_CB, POI_SIMILAR_CB, POI_STAR_CB
 )
 from raybot.model import db
+from raybot.model.spatial import get_poi_grid
+from raybot.model.houses import get_house_tree
+from raybot.model.autocomplete import get_loaded_autocomplete
 from raybot.bot import dp, bot
-from raybot.util import split_tokens, unpack_ids, save_location, tr
+from raybot.util import split_tokens, save_location, get_user, tr
+from raybot.util.results import get_result_store
 from raybot import config
 from typing import Dict
 from aiogram import types
@@ -17,20 +21,27 @@ from aiogram.utils.exceptions import MessageNotModified
 @dp.callback_query_handler(POI_FULL_CB.filter(), state='*')
 async def all_pois(query: types.CallbackQuery, callback_data: Dict[str, str],
                    state: FSMContext):
-    cur_state = None if not state else await state.get_state()
-    if cur_state == PoiState.poi_list.state:
-        data = await state.get_data()
-        txt = data['query']
-        pois = await db.get_poi_by_ids(data['poi'])
+    token = callback_data['token']
+    page = int(callback_data['page'])
+    result = get_result_store().get(token)
+    if result:
+        txt = result.query
+        by_id = {p.id: p for p in await db.get_poi_by_ids(result.ids)}
+        pois = [by_id[i] for i in result.ids if i in by_id]
+        # Keep the stored order, unless it can be sorted by a new location
+        location = (await get_user(query.from_user)).location
+        shuffle = location is not None and location != result.location
     else:
+        # The result set has expired, so we have to repeat the search
         txt = callback_data['query']
-        ids = callback_data['ids']
-        if len(ids) < 2:
-            tokens = split_tokens(txt)
-            pois = await db.find_poi(' '.join(tokens))
-        else:
-            pois = await db.get_poi_by_ids(unpack_ids(ids))
-    await print_poi_list(query.from_user, txt, pois, True)
+        tokens = split_tokens(txt)
+        if not tokens:
+            await query.answer(tr('query_fail'))
+            return
+        pois = await db.find_poi(' '.join(tokens))
+        shuffle = True
+    await print_poi_list(query.from_user, txt, pois, True, shuffle=shuffle,
+                         token=token, page=page)
 
 
 @dp.callback_query_handler(POI_LIST_CB.filter(), state='*')
@@ -61,6 +72,9 @@ async def star_poi(query: types.CallbackQuery, callback_data: Dict[str, str]):
         await db.set_star(user.id, poi.id, True)
     elif action == 'del':
         await db.set_star(user.id, poi.id, False)
+    autocomplete = get_loaded_autocomplete()
+    if autocomplete is not None:
+        autocomplete.set_stars(poi.id, (await db.count_stars(user.id, poi.id))[0])
     kbd = await make_poi_keyboard(user, poi)
     try:
         await bot.edit_message_reply_markup(
@@ -85,10 +99,10 @@ async def in_house_callback(query: types.CallbackQuery, callback_data: Dict[str,
                             state: FSMContext):
     house = callback_data['house']
     floor = callback_data['floor']
-    data = await db.get_poi_by_key(house)
-    pois = await db.get_poi_by_house(house, None if floor == '-' else floor)
+    data = (await get_house_tree()).get(house)
+    pois = [] if not data else data.get_pois(None if floor == '-' else floor)
     if floor == '-' and len(pois) > 9:
-        floors = await db.get_floors_by_house(house)
+        floors = data.get_floors()
         if len(floors) >= 2 and None not in floors:
             # We have floors - add another selection
             kbd = types.InlineKeyboardMarkup(row_width=3)
@@ -108,7 +122,9 @@ async def in_house_callback(query: types.CallbackQuery, callback_data: Dict[str,
     else:
         await PoiState.poi_list.set()
         await state.set_data({'query': query, 'poi': [p.id for p in pois]})
-        await print_poi_list(query.from_user, data.name, pois, True)
+        building = data.building or await db.get_poi_by_key(house)
+        title = building.name if building else pois[0].house_name or house
+        await print_poi_list(query.from_user, title, pois, True)
 
 
 @dp.callback_query_handler(POI_SIMILAR_CB.filter(), state='*')
@@ -171,5 +187,7 @@ async def print_popular(message: types.Message, state: FSMContext):
 async def set_loc(message: types.Message, state: FSMContext):
     await save_location(message)
     data = await state.get_data()
-    pois = await db.get_poi_by_ids(data['poi'])
+    pois = (await get_poi_grid()).get(data['poi'])
+    if len(pois) < len(data['poi']):
+        pois = await db.get_poi_by_ids(data['poi'])
     await print_poi_list(message.from_user, data['query'], pois)
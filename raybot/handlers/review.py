@@ -1,4 +1,7 @@
-from raybot.model import db, POI, Location
+from raybot import metrics
+from raybot.model import db, geometry, POI, Location
+from raybot.model.spatial import get_poi_grid
+from raybot.model.houses import get_house_tree
 from raybot.bot import bot, dp
 from raybot.util import get_user, get_buttons, delete_msg, DOW, tr
 from raybot.actions.poi import POI_EDIT_CB, REVIEW_HOUSE_CB
@@ -13,7 +16,8 @@ REVIEW_CB = CallbackData('review_poi', 'id')
 EDIT_CB = CallbackData('review_edit', 'mode')
 
 
-async def check_floors(query: types.CallbackQuery, pois: List[POI], house: str = None):
+async def check_floors(query: types.CallbackQuery, pois: List[POI], house: str = None,
+                       floors: List[str] = None):
     if not pois:
         kbd = types.InlineKeyboardMarkup().add(
             types.InlineKeyboardButton(tr('add_poi'), callback_data='new')
@@ -21,7 +25,8 @@ async def check_floors(query: types.CallbackQuery, pois: List[POI], house: str =
         await bot.send_message(query.from_user.id, tr('no_poi_around'), reply_markup=kbd)
         return
 
-    floors = set([p.floor for p in pois])
+    if floors is None:
+        floors = set([p.floor for p in pois])
     if len(floors) >= 2:
         khouse = '-' if house is None else house
         kbd = types.InlineKeyboardMarkup(row_width=3)
@@ -50,7 +55,7 @@ async def start_review_callback(query: types.CallbackQuery):
         # We have an ongoing review session, continue it
         await start_review(query.from_user, *info.review_ctx)
         return
-    pois = await db.get_poi_around(info.location, count=10)
+    pois = (await get_poi_grid()).nearest(info.location, 10, max_dist=100)
     # Find floor options
     await check_floors(query, pois)
 
@@ -58,8 +63,11 @@ async def start_review_callback(query: types.CallbackQuery):
 @dp.callback_query_handler(REVIEW_HOUSE_CB.filter(), state='*')
 async def review_from_house(query: types.CallbackQuery, callback_data: Dict[str, str]):
     house = callback_data['house']
-    pois = await db.get_poi_by_house(house)
-    await check_floors(query, pois, house)
+    data = (await get_house_tree()).get(house)
+    if not data:
+        await check_floors(query, [], house)
+    else:
+        await check_floors(query, data.get_pois(), house, data.get_floors())
 
 
 @dp.callback_query_handler(FLOOR_CB.filter(), state='*')
@@ -90,11 +98,13 @@ async def continue_review(query: types.CallbackQuery):
     await print_review_message(query.from_user)
 
 
+@metrics.timed('start_review')
 async def start_review(user: types.User, house: str = None, floor: str = None):
     """Set floor to "-" to search only absent floors."""
     info = await get_user(user)
     if house is not None:
-        pois = await db.get_poi_by_house(house, floor)
+        data = (await get_house_tree()).get(house)
+        pois = [] if not data else data.get_pois(floor)
         if info.location:
             ref = info.location
         else:
@@ -103,9 +113,9 @@ async def start_review(user: types.User, house: str = None, floor: str = None):
                 await bot.send_message(user.id, tr(('review', 'too_many')))
                 return
             ref = pois[0].location
-        pois.sort(key=lambda p: ref.distance(p.location))
+        pois = [pois[i] for i in geometry.nearest(ref, [p.location for p in pois])]
     else:
-        pois = await db.get_poi_around(info.location, count=30, floor=floor)
+        pois = (await get_poi_grid()).nearest(info.location, 30, floor=floor, max_dist=100)
     if len(pois) > 14:
         # Sort by "not reviewed in the past ten hours"
         ages = await db.get_poi_ages([p.id for p in pois])
@@ -136,6 +146,7 @@ async def make_review_keyboard(pois: List[POI], edit: bool = False):
     return kbd
 
 
+@metrics.timed('print_review_message')
 async def print_review_message(user: types.User, pois: List[POI] = None):
     if not pois:
         info = await get_user(user)
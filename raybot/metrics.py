@@ -0,0 +1,144 @@
+"""Process-wide counters and histograms, exported in the Prometheus text format.
+Start the HTTP endpoint with start_server()."""
+import time
+from aiohttp import web
+from contextvars import ContextVar
+from functools import wraps
+from typing import Dict, List, Tuple
+
+
+# Upper bounds in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts: List[int] = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+
+_counters: Dict[str, Dict[Labels, float]] = {}
+_histograms: Dict[str, Dict[Labels, Histogram]] = {}
+_help: Dict[str, str] = {}
+# Seconds spent on resources like "db" or "telegram" while processing the current update
+_update_times: ContextVar[Dict[str, float]] = ContextVar('update_times', default=None)
+
+
+def _key(labels: Dict[str, str]) -> Labels:
+    return () if not labels else tuple(sorted(labels.items()))
+
+
+def describe(name: str, text: str):
+    _help[name] = text
+
+
+def inc(name: str, value: float = 1, labels: Dict[str, str] = None):
+    series = _counters.setdefault(name, {})
+    key = _key(labels)
+    series[key] = series.get(key, 0) + value
+
+
+def get(name: str, labels: Dict[str, str] = None) -> float:
+    return _counters.get(name, {}).get(_key(labels), 0)
+
+
+def observe(name: str, value: float, labels: Dict[str, str] = None):
+    series = _histograms.setdefault(name, {})
+    key = _key(labels)
+    if key not in series:
+        series[key] = Histogram()
+    series[key].observe(value)
+
+
+def get_histogram(name: str, labels: Dict[str, str] = None) -> Histogram:
+    return _histograms.get(name, {}).get(_key(labels))
+
+
+def timed(action: str):
+    """Decorates a coroutine function to observe its duration in action_seconds."""
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                observe('action_seconds', time.perf_counter() - start, {'action': action})
+        return wrapper
+    return decorator
+
+
+def start_update() -> Dict[str, float]:
+    """Starts collecting resource times for the update processed in the current context."""
+    times = {}
+    _update_times.set(times)
+    return times
+
+
+def update_times() -> Dict[str, float]:
+    return _update_times.get()
+
+
+def add_time(resource: str, seconds: float):
+    times = _update_times.get()
+    if times is not None:
+        times[resource] = times.get(resource, 0) + seconds
+
+
+def _format_labels(key: Labels, extra: str = None) -> str:
+    def escape(v):
+        return str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    parts = [f'{k}="{escape(v)}"' for k, v in key]
+    if extra:
+        parts.append(extra)
+    return '' if not parts else '{' + ','.join(parts) + '}'
+
+
+def render() -> str:
+    lines = []
+    for name in sorted(_counters):
+        if name in _help:
+            lines.append(f'# HELP {name} {_help[name]}')
+        lines.append(f'# TYPE {name} counter')
+        for key, value in sorted(_counters[name].items()):
+            lines.append(f'{name}{_format_labels(key)} {value}')
+    for name in sorted(_histograms):
+        if name in _help:
+            lines.append(f'# HELP {name} {_help[name]}')
+        lines.append(f'# TYPE {name} histogram')
+        for key, hist in sorted(_histograms[name].items()):
+            total = 0
+            for bound, count in zip(hist.buckets, hist.counts):
+                total += count
+                le = f'le="{bound}"'
+                lines.append(f'{name}_bucket{_format_labels(key, le)} {total}')
+            le = 'le="+Inf"'
+            lines.append(f'{name}_bucket{_format_labels(key, le)} {hist.count}')
+            lines.append(f'{name}_sum{_format_labels(key)} {hist.sum}')
+            lines.append(f'{name}_count{_format_labels(key)} {hist.count}')
+    return '\n'.join(lines) + '\n'
+
+
+async def start_server(port: int, host: str = 'localhost') -> web.AppRunner:
+    """Serves render() on http://host:port/metrics. Returns a runner to clean up."""
+    async def handle(request):
+        return web.Response(text=render(), content_type='text/plain')
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
@@ -1,2 +1,2 @@
 from .entities import Location, UserInfo, POI
-from . import db
+from . import db, geometry
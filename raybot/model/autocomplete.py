@@ -0,0 +1,179 @@
+"""Prefix trie over words of poi names and keywords, for inline queries.
+Results are ranked by stars. Kept current through db.add_poi_listener()."""
+import heapq
+from . import db
+from .entities import POI
+from .normalize import get_normalizer
+from typing import Dict, Iterator, List, Set
+
+
+class TrieNode:
+    __slots__ = ('children', 'ids', 'top', 'size')
+
+    def __init__(self):
+        self.children: Dict[str, TrieNode] = {}
+        self.size = 0  # number of words in the subtree
+        self.ids: Set[int] = None  # pois with a word ending here
+        self.top: List[int] = None  # best ranked pois in the subtree, None to recalculate
+
+
+class Autocomplete:
+    TOP = 20
+    # Subtrees with up to this many words are scanned instead of merging child tops
+    SCAN_SIZE = 200
+
+    def __init__(self):
+        self.root = TrieNode()
+        self.pois: Dict[int, POI] = {}
+        self.poi_words: Dict[int, Set[str]] = {}
+        self.stars: Dict[int, int] = {}
+
+    @staticmethod
+    def get_words(poi: POI) -> Set[str]:
+        norm = get_normalizer()
+        return {w for v in (poi.name, poi.keywords) if v for w in norm.split(v, process=False)}
+
+    def rank(self, poi_id: int):
+        return self.stars.get(poi_id, 0), -poi_id
+
+    def _path(self, word: str, create: bool = False) -> List[TrieNode]:
+        node = self.root
+        path = [node]
+        for c in word:
+            child = node.children.get(c)
+            if child is None:
+                if not create:
+                    return None
+                child = node.children[c] = TrieNode()
+            node = child
+            path.append(node)
+        return path
+
+    def add(self, poi: POI):
+        self.pois[poi.id] = poi
+        words = self.get_words(poi)
+        self.poi_words[poi.id] = words
+        for word in words:
+            path = self._path(word, create=True)
+            if path[-1].ids is None:
+                path[-1].ids = set()
+            path[-1].ids.add(poi.id)
+            for node in path:
+                node.size += 1
+                if node.top is not None and poi.id not in node.top:
+                    node.top.append(poi.id)
+                    node.top.sort(key=self.rank, reverse=True)
+                    del node.top[self.TOP:]
+
+    def remove(self, poi_id: int):
+        self.pois.pop(poi_id, None)
+        stale = {}  # id(node) -> (depth, node) for nodes that ranked the poi
+        for word in self.poi_words.pop(poi_id, ()):
+            path = self._path(word)
+            path[-1].ids.discard(poi_id)
+            for depth, node in enumerate(path):
+                node.size -= 1
+                if node.top is not None and poi_id in node.top:
+                    node.top = None
+                    stale[id(node)] = (depth, node)
+            # Drop empty branches
+            for i in range(len(word), 0, -1):
+                if path[i].size:
+                    break
+                del path[i - 1].children[word[i - 1]]
+        # Recompute from the bottom up, so that every node merges cached child tops
+        for _, node in sorted(stale.values(), key=lambda n: n[0], reverse=True):
+            if node.size:
+                self._top(node)
+
+    def update(self, poi_id: int, poi: POI):
+        self.remove(poi_id)
+        if poi is not None and poi.delete_reason is None and poi.in_index:
+            self.add(poi)
+
+    def set_stars(self, poi_id: int, stars: int):
+        self.stars[poi_id] = stars
+        poi = self.pois.get(poi_id)
+        if poi:
+            # Re-adding updates rankings on the path
+            self.remove(poi_id)
+            self.add(poi)
+
+    @staticmethod
+    def _subtree_ids(node: TrieNode) -> Iterator[int]:
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if node.ids:
+                yield from node.ids
+            stack.extend(node.children.values())
+
+    def _top(self, node: TrieNode) -> List[int]:
+        if node.top is None:
+            if node.size <= self.SCAN_SIZE:
+                candidates = set(self._subtree_ids(node))
+            else:
+                # Best pois of a subtree are among the best of its children
+                candidates = set(node.ids or ())
+                for child in node.children.values():
+                    candidates.update(self._top(child))
+            node.top = heapq.nlargest(self.TOP, candidates, key=self.rank)
+        return node.top
+
+    def search(self, query: str, limit: int = TOP) -> List[POI]:
+        """Returns pois that have words starting with every token of the query."""
+        tokens = get_normalizer().split(query, process=False)
+        if not tokens:
+            return []
+        nodes = []
+        for token in tokens:
+            path = self._path(token)
+            if not path:
+                return []
+            nodes.append((path[-1].size, token, path[-1]))
+        if len(nodes) == 1:
+            ids = self._top(nodes[0][2])[:limit]
+        else:
+            # Start from the smallest subtree and check other tokens for each poi
+            nodes.sort(key=lambda n: n[0])
+            others = [n[1] for n in nodes[1:]]
+            ids = [i for i in set(self._subtree_ids(nodes[0][2]))
+                   if all(any(w.startswith(t) for w in self.poi_words[i]) for t in others)]
+            ids = heapq.nlargest(limit, ids, key=self.rank)
+        return [self.pois[i] for i in ids]
+
+
+_autocomplete: Autocomplete = None
+_listening = False
+
+
+def _on_poi_changed(poi_id: int, poi: POI):
+    global _autocomplete
+    if poi_id is None:
+        # Rebuild on the next request
+        _autocomplete = None
+    elif _autocomplete is not None:
+        _autocomplete.update(poi_id, poi)
+
+
+def get_loaded_autocomplete() -> Autocomplete:
+    """Returns the trie if it has been built, None otherwise."""
+    return _autocomplete
+
+
+async def get_autocomplete() -> Autocomplete:
+    global _autocomplete, _listening
+    if not _listening:
+        db.add_poi_listener(_on_poi_changed)
+        _listening = True
+    if _autocomplete is None:
+        conn = await db.get_db()
+        ac = Autocomplete()
+        cursor = await conn.execute("select poi_id, count(*) from stars group by poi_id")
+        ac.stars = {r[0]: r[1] async for r in cursor}
+        cursor = await conn.execute(
+            f"{db.POI_SELECT} where poi.in_index and poi.delete_reason is null")
+        async for row in cursor:
+            ac.add(POI(row))
+        _autocomplete = ac
+    return _autocomplete
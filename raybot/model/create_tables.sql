@@ -13,6 +13,7 @@ create table poi (
   photo_in text,
   tag text, -- OSM key=value
   hours text, -- OSM format
+  open_slots blob, -- weekly bitset for hours, see openhours.py
   links text, -- json list of tuples: [['name': 'link'], ...]
   has_wifi boolean, -- this and next can be null
   accepts_cards boolean,
@@ -25,6 +26,9 @@ create table poi (
   delete_reason text
 );
 create unique index poi_str_id_idx on poi (str_id);
+create index if not exists poi_house_idx on poi (house, flor);
+create index if not exists poi_tag_idx on poi (tag);
+create index if not exists poi_needs_check_idx on poi (created) where needs_check;
 
 create virtual table poisearch using fts3(name, keywords, tag, tokenize=unicode61);
 -- When modifying poi, also modify rows in poisearch, using the "docid" column.
@@ -40,6 +44,7 @@ create table queue (
   old_value text,
   new_value text
 );
+create index if not exists queue_ts_idx on queue (ts);
 
 create table poi_audit (
   id integer primary key,
@@ -77,6 +82,14 @@ create table file_ids (
     file_id text not null
 );
 
+create table if not exists photo_hashes (
+    name text not null primary key,
+    size integer not null,
+    mtime real not null,
+    md5 text not null,
+    phash text not null
+);
+
 create table stars(
     poi_id integer not null,
     user_id integer not null,
@@ -1,33 +1,136 @@
 import aiosqlite
+import asyncio
 import logging
 import os
 import json
-from raybot import config
+import re
+import sys
+import time
+from collections import OrderedDict
+from raybot import config, metrics
 from .entities import POI, UserInfo, QueueMessage, Location
-from typing import List, Dict, Tuple
+from .normalize import get_normalizer
+from . import geometry, openhours
+from typing import List, Dict, Tuple, Callable, Sequence
 
 
 _db = None
+_db_lock = None
+# Stored in "pragma user_version", bump to rebuild poisearch when search_values() changes
+INDEX_VERSION = 1
+# Functions (poi_id, poi) called after a poi has been written.
+# The poi is None when it has been deleted forever, and both are None after bulk changes.
+_poi_listeners: List[Callable[[int, POI], None]] = []
+# Incremented on every poi write, so that cached results can be dropped
+_generation = 0
+# Normalized query -> (generation, pois), most recently used last
+_search_cache: OrderedDict = OrderedDict()
+SEARCH_CACHE_SIZE = 1000
+_search_miss_time = 0.0  # Moving average of an uncached search duration
+metrics.describe('search_cache_hits_total', 'Searches served from the query cache')
+metrics.describe('search_cache_misses_total', 'Searches that went to the database')
+metrics.describe('search_cache_saved_seconds_total', 'Estimated time saved by the cache')
+metrics.describe('db_seconds', 'Database calls by function, not including fetching rows')
+# Set to a list to collect (query name, sql, params) for every executed query
+captured_queries: List[Tuple[str, str, tuple]] = None
+# Selects pois with their house names, qualify columns with "poi." in conditions
+POI_SELECT = ("select poi.*, h.name as h_address from poi "
+              "left join poi h on h.str_id = poi.house")
 
 
 async def get_db():
-    global _db
+    global _db, _db_lock
     if _db is not None and _db._running:
         return _db
-    _db = await aiosqlite.connect(config.DATABASE)
-    _db.row_factory = aiosqlite.Row
-    exists_query = ("select count(*) from sqlite_master where type = 'table' "
-                    "and name in ('poi', 'poisearch', 'roles')")
-    async with _db.execute(exists_query) as cursor:
+    if _db_lock is None:
+        _db_lock = asyncio.Lock()
+    async with _db_lock:
+        # Another task might have connected while we waited
+        if _db is not None and _db._running:
+            return _db
+        _db = await aiosqlite.connect(config.DATABASE)
+        _db.row_factory = aiosqlite.Row
+        for method in ('execute', 'executemany', 'commit'):
+            setattr(_db, method, _timed(getattr(_db, method)))
+        exists_query = ("select count(*) from sqlite_master where type = 'table' "
+                        "and name in ('poi', 'poisearch', 'roles')")
+        cursor = await _db.execute(exists_query)
         has_tables = (await cursor.fetchone())[0] == 3
-    if not has_tables:
-        logging.info('Creating tables')
-        with open(os.path.join(os.path.dirname(__file__), 'create_tables.sql'), 'r') as f:
-            queries = [q.strip() for q in f.read().split(';')]
-        for q in queries:
-            if q:
-                await _db.execute(q)
-    return _db
+        if not has_tables:
+            logging.info('Creating tables')
+            with open(os.path.join(os.path.dirname(__file__), 'create_tables.sql'), 'r') as f:
+                queries = [q.strip() for q in f.read().split(';')]
+            for q in queries:
+                if q:
+                    await _db.execute(q)
+        else:
+            # Tables and indexes added later are created with "if not exists"
+            with open(os.path.join(os.path.dirname(__file__), 'create_tables.sql'), 'r') as f:
+                queries = [q.strip() for q in f.read().split(';')]
+            for q in queries:
+                if q.startswith(('create index if not exists', 'create table if not exists')):
+                    await _db.execute(q)
+            cursor = await _db.execute("pragma table_info(poi)")
+            columns = [r[1] async for r in cursor]
+            if 'open_slots' not in columns:
+                logging.info('Adding open_slots to the poi table')
+                await _db.execute("alter table poi add column open_slots blob")
+                await update_open_slots()
+        cursor = await _db.execute("pragma user_version")
+        version = (await cursor.fetchone())[0]
+        if version < INDEX_VERSION:
+            logging.info('Rebuilding the search index')
+            await _db.execute(f"pragma user_version = {INDEX_VERSION}")
+            await reindex()
+        return _db
+
+
+def _timed(method):
+    """Wraps a connection method to record its duration. Queries are named
+    after the calling function, and slow ones are logged with their plans."""
+    async def wrapper(sql=None, params=None, *args, **kwargs):
+        name = sys._getframe(1).f_code.co_name if sql else method.__name__
+        if captured_queries is not None and sql:
+            captured_queries.append((name, sql, params))
+        start = time.perf_counter()
+        try:
+            if sql is None:
+                return await method(*args, **kwargs)
+            return await method(sql, params, *args, **kwargs)
+        finally:
+            duration = time.perf_counter() - start
+            metrics.observe('db_seconds', duration, {'query': name})
+            metrics.add_time('db', duration)
+            if config.SLOW_QUERY_MS and duration * 1000 >= config.SLOW_QUERY_MS:
+                await _log_slow_query(method, name, sql, params, duration)
+    return wrapper
+
+
+async def _log_slow_query(execute, name: str, sql: str, params, duration: float):
+    if sql is None:
+        # A commit or another call without a query
+        logging.warning('Slow %s took %.0f ms', name, duration * 1000)
+        return
+    plan = []
+    if execute.__name__ == 'execute':
+        try:
+            cursor = await execute(f'explain query plan {sql}', params)
+            plan = [r[3] async for r in cursor]
+        except Exception as e:
+            plan = [f'Could not explain: {e}']
+    elif hasattr(params, '__len__'):
+        params = f'{len(params)} rows'
+    else:
+        params = 'rows from an iterator'
+    logging.warning('Slow query %s took %.0f ms: %s; params: %.200r%s', name, duration * 1000,
+                    ' '.join(str(sql).split()), params,
+                    ''.join(f'\n    {line}' for line in plan))
+
+
+def full_scans(plan: List[str]) -> List[str]:
+    """Returns lines of an EXPLAIN QUERY PLAN output that scan a whole table."""
+    return [line for line in plan
+            if re.match(r'^SCAN (TABLE )?\w+', line) and ' USING ' not in line]
 
 
 async def close():
@@ -35,9 +138,26 @@ async def close():
         await _db.close()
 
 
+def add_poi_listener(listener: Callable[[int, POI], None]):
+    """Registers a function to keep in-memory indexes current."""
+    _poi_listeners.append(listener)
+
+
+async def notify_poi_changed(poi_id: int = None):
+    global _generation
+    _generation += 1
+    if not _poi_listeners:
+        return
+    poi = None if poi_id is None else await get_poi_by_id(poi_id)
+    for listener in _poi_listeners:
+        try:
+            listener(poi_id, poi)
+        except Exception:
+            logging.exception('Failed to update an index for poi %s', poi_id)
+
+
 async def get_poi_by_id(poi_id: int) -> POI:
-    query = ("select poi.*, h.name as h_address from poi "
-             "left join poi h on h.str_id = poi.house where poi.id = ?")
+    query = f"{POI_SELECT} where poi.id = ?"
     db = await get_db()
     cursor = await db.execute(query, (poi_id,))
     row = await cursor.fetchone()
@@ -58,7 +178,7 @@ async def get_poi_by_house(house: str, floor: str = None) -> POI:
     if floor == '-':
         query += " and flor is null"
         args = (house, )
-    if floor:
+    elif floor:
         query += " and flor = ?"
         args = (house, floor)
     else:
@@ -174,19 +294,42 @@ async def get_poi_around(loc: Location, count: int = 40, floor: str = None,
     db = await get_db()
     cursor = await db.execute(query, tuple(args))
     pois = [POI(r) async for r in cursor]
-    pois = sorted([p for p in pois if loc.distance(p.location) <= dist],
-                  key=lambda p: loc.distance(p.location))
-    return pois[:count]
+    idx = geometry.nearest(loc, [p.location for p in pois], k=count, max_dist=dist)
+    return [pois[i] for i in idx]
 
 
 async def find_poi(keywords: str) -> List[POI]:
+    """Results are cached until the next write to the poi table,
+    and copies are returned so that callers can change them."""
+    global _search_miss_time
+    start = time.perf_counter()
+    key = ' '.join(keywords.lower().split())
+    cached = _search_cache.get(key)
+    if cached and cached[0] == _generation:
+        _search_cache.move_to_end(key)
+        metrics.inc('search_cache_hits_total')
+        metrics.inc('search_cache_saved_seconds_total',
+                    max(0, _search_miss_time - (time.perf_counter() - start)))
+        return [poi.copy() for poi in cached[1]]
+
     query = ("select poi.*, h.name as h_address from poi "
              "left join poi h on h.str_id = poi.house "
              "where poi.in_index and poi.delete_reason is null and "
              "poi.rowid in (select docid from poisearch where poisearch match ?)")
     db = await get_db()
+    generation = _generation
     cursor = await db.execute(query, (keywords,))
-    return [POI(r) async for r in cursor]
+    pois = [POI(r) async for r in cursor]
+    if generation == _generation:
+        _search_cache[key] = (generation, tuple(poi.copy() for poi in pois))
+        _search_cache.move_to_end(key)
+        while len(_search_cache) > SEARCH_CACHE_SIZE:
+            _search_cache.popitem(last=False)
+    duration = time.perf_counter() - start
+    _search_miss_time = duration if not _search_miss_time else (
+        _search_miss_time * 0.9 + duration * 0.1)
+    metrics.inc('search_cache_misses_total')
+    return pois
 
 
 async def poi_with_empty_value(field: str, buildings: bool = False,
@@ -264,6 +407,28 @@ async def find_file_ids(paths: Dict[str, int]) -> Dict[str, str]:
             if r['size'] == paths[r['path']]}
 
 
+async def get_photo_hashes() -> Dict[str, Tuple[int, float, str, str]]:
+    """Returns photo name -> (size, mtime, md5, phash)."""
+    db = await get_db()
+    cursor = await db.execute("select name, size, mtime, md5, phash from photo_hashes")
+    return {r[0]: tuple(r[1:]) async for r in cursor}
+
+
+async def store_photo_hashes(rows: Sequence[Tuple[str, int, float, str, str]]) -> None:
+    """Stores (name, size, mtime, md5, phash) rows."""
+    query = ("insert or replace into photo_hashes (name, size, mtime, md5, phash) "
+             "values (?, ?, ?, ?, ?)")
+    db = await get_db()
+    await db.executemany(query, rows)
+    await db.commit()
+
+
+async def delete_photo_hashes(names: Sequence[str]) -> None:
+    db = await get_db()
+    await db.executemany("delete from photo_hashes where name = ?", [(n,) for n in names])
+    await db.commit()
+
+
 async def find_path_for_file_id(file_id: str) -> str:
     db = await get_db()
     query = "select path from file_ids where file_id = ? limit 1"
@@ -272,6 +437,55 @@ async def find_path_for_file_id(file_id: str) -> str:
     return None if not row else row[0]
 
 
+def search_values(name: str, keywords: str, tag: str) -> Tuple[str, str, str]:
+    """Returns (name, keywords, tag keywords) folded and stemmed for the poisearch table."""
+    norm = get_normalizer()
+    tagkw = ' '.join(config.TAGS['tags'].get(tag, [])) or None
+    return norm.index_text(name), norm.index_text(keywords), norm.index_text(tagkw)
+
+
+async def make_open_slots(hours_src: str) -> bytes:
+    """Runs openhours.make_slots() in an executor, not to block the loop."""
+    if not hours_src:
+        return None
+    return await asyncio.get_running_loop().run_in_executor(
+        None, openhours.make_slots, hours_src)
+
+
+async def update_open_slots(poi_ids: List[int] = None, stale_only: bool = False) -> int:
+    """Recalculates opening hours bitsets for given or all pois. With stale_only,
+    only rebuilds bitsets made for another week, and notifies listeners for each
+    changed poi instead of dropping all indexes. Returns the number of changed pois."""
+    db = await get_db()
+    if poi_ids is None:
+        cursor = await db.execute(
+            "select id, hours, open_slots from poi where hours is not null")
+    else:
+        cursor = await db.execute("select id, hours, open_slots from poi where id in ({})".format(
+            ','.join('?' * len(poi_ids))), tuple(poi_ids))
+    rows = [tuple(r) async for r in cursor]
+    if stale_only:
+        # Hours without a bitset have date rules or do not parse, and stay that way
+        # until edited, when writers make new bitsets
+        week = openhours.get_week()
+        rows = [r for r in rows if r[2] is not None and openhours.slots_week(r[2]) != week]
+    if not rows:
+        return 0
+    slots = await asyncio.get_running_loop().run_in_executor(
+        None, openhours.make_many_slots, [r[1] for r in rows])
+    changed = [(s, r[0]) for s, r in zip(slots, rows) if s != r[2]]
+    if not changed:
+        return 0
+    await db.executemany("update poi set open_slots = ? where id = ?", changed)
+    await db.commit()
+    if stale_only:
+        for _, poi_id in changed:
+            await notify_poi_changed(poi_id)
+    else:
+        await notify_poi_changed(None)
+    return len(changed)
+
+
 async def get_houses() -> List[POI]:
     query = "select * from poi where str_id is not null and tag = 'building'"
     db = await get_db()
@@ -297,15 +511,15 @@ async def insert_poi(user_id: int, poi: POI):
     rowid = (await cursor.fetchone())[0]
     poi.id = rowid
     await save_audit(user_id, user_id, None, poi)
+    if poi.hours_src:
+        await db.execute("update poi set open_slots = ? where id = ?",
+                         (await make_open_slots(poi.hours_src), rowid))
 
     # Now update the search index
-    tagkw = ' '.join(config.TAGS['tags'].get(poi.tag, [])) or None
-    query2 = ("insert into poisearch (docid, name, keywords, tag) "
-              "select rowid, replace(replace(name, 'Ё', 'Е'), 'ё', 'е') as name, "
-              "  replace(keywords, 'ё', 'е') as keywords, ? "
-              "from poi where id = ?")
-    await db.execute(query2, (tagkw, rowid))
+    query2 = "insert into poisearch (docid, name, keywords, tag) values (?, ?, ?, ?)"
+    await db.execute(query2, (rowid, *search_values(poi.name, poi.keywords, poi.tag)))
     await db.commit()
+    await notify_poi_changed(poi.id)
     return poi.id
 
 
@@ -320,14 +534,15 @@ async def update_poi(user_id: int, poi: POI):
     db = await get_db()
     await db.execute(query, (*fields.values(), poi.id))
     await save_audit(user_id, user_id, orig, poi)
+    if 'hours' in fields:
+        await db.execute("update poi set open_slots = ? where id = ?",
+                         (await make_open_slots(poi.hours_src), poi.id))
     if 'keywords' in fields or 'tag' in fields or 'name' in fields:
-        tagkw = ' '.join(config.TAGS['tags'].get(poi.tag, [])) or None
-        query2 = ("update poisearch set keywords = ?, name = ?, "
+        query2 = ("update poisearch set name = ?, keywords = ?, "
                   "tag = ? where docid = ?")
-        kw = None if not poi.keywords else poi.keywords.lower().replace('ё', 'е')
-        await db.execute(query2, (kw, poi.name.replace('Ё', 'Е').replace('ё', 'е'),
-                                  tagkw, poi.id))
+        await db.execute(query2, (*search_values(poi.name, poi.keywords, poi.tag), poi.id))
     await db.commit()
+    await notify_poi_changed(poi.id)
     return poi.id
 
 
@@ -340,6 +555,7 @@ async def delete_poi(user_id: int, poi: POI, reason: str):
     await db.execute("update poi set delete_reason = ?, updated = current_timestamp "
                      "where id = ?", (reason, poi.id))
     await db.commit()
+    await notify_poi_changed(poi.id)
 
 
 async def delete_poi_forever(user_id: int, poi: POI):
@@ -348,6 +564,7 @@ async def delete_poi_forever(user_id: int, poi: POI):
     await db.execute("delete from poisearch where docid = ?", (poi.id,))
     await db.execute("delete from poi where id = ?", (poi.id,))
     await db.commit()
+    await notify_poi_changed(poi.id)
 
 
 async def restore_poi(user_id: int, poi: POI):
@@ -357,12 +574,10 @@ async def restore_poi(user_id: int, poi: POI):
     await db.execute(query, (user_id, user_id, poi.id, poi.delete_reason, None))
     await db.execute("update poi set delete_reason = null, updated = current_timestamp "
                      "where id = ?", (poi.id, ))
-    tagkw = ' '.join(config.TAGS['tags'].get(poi.tag, [])) or None
-    query2 = "insert into poisearch (keywords, name, tag, docid) values (?, ?, ?, ?)"
-    kw = None if not poi.keywords else poi.keywords.lower().replace('ё', 'е')
-    await db.execute(query2, (kw, poi.name.replace('Ё', 'Е').replace('ё', 'е'),
-                              tagkw, poi.id))
+    query2 = "insert into poisearch (name, keywords, tag, docid) values (?, ?, ?, ?)"
+    await db.execute(query2, (*search_values(poi.name, poi.keywords, poi.tag), poi.id))
     await db.commit()
+    await notify_poi_changed(poi.id)
 
 
 async def save_audit(user_id: int, approved_by: int, oldpoi: POI, poi: POI):
@@ -445,17 +660,19 @@ async def apply_queue(user_id: int, q: QueueMessage):
     await db.execute(query, (q.new_value, q.poi_id))
     query = ("insert into poi_audit (user_id, approved_by, poi_id, field, "
              "old_value, new_value) values (?, ?, ?, ?, ?, ?)")
-    if q.field == 'keywords':
-        query2 = ("update poisearch set keywords = (select replace(keywords, 'ё', 'е') "
-                  "from poi where id = ?) where docid = ?")
-        await db.execute(query2, (q.poi_id, q.poi_id))
-    elif q.field == 'tag':
-        tagkw = ' '.join(config.TAGS['tags'].get(q.new_value, [])) or None
-        query2 = "update poisearch set tag = ? where docid = ?"
-        await db.execute(query2, (tagkw, q.poi_id))
+    if q.field in ('name', 'keywords', 'tag'):
+        cursor = await db.execute(
+            "select name, keywords, tag from poi where id = ?", (q.poi_id,))
+        row = await cursor.fetchone()
+        query2 = "update poisearch set name = ?, keywords = ?, tag = ? where docid = ?"
+        await db.execute(query2, (*search_values(*row), q.poi_id))
+    elif q.field == 'hours':
+        await db.execute("update poi set open_slots = ? where id = ?",
+                         (await make_open_slots(q.new_value), q.poi_id))
     await db.execute(query, (q.user_id, user_id, q.poi_id, q.field, q.old_value, q.new_value))
     await db.execute("delete from queue where id = ?", (q.id,))
     await db.commit()
+    await notify_poi_changed(q.poi_id)
 
 
 async def get_next_unchecked():
@@ -471,6 +688,7 @@ async def validate_poi(poi_id: int):
     db = await get_db()
     await db.execute(query, (poi_id,))
     await db.commit()
+    await notify_poi_changed(poi_id)
 
 
 async def get_last_poi(count: int = 1):
@@ -519,19 +737,13 @@ async def get_stats():
 async def reindex():
     conn = await get_db()
     await conn.execute("delete from poisearch")
-    # Create temporary tag table
-    await conn.execute("create table tag_keywords (tag text not null, tagkw text not null)")
-    await conn.executemany("insert into tag_keywords (tag, tagkw) values (?, ?)",
-                           [(k, ' '.join(v)) for k, v in config.TAGS['tags'].items()])
-    await conn.execute(
-        "insert into poisearch (docid, name, keywords, tag) "
-        "select poi.rowid, replace(replace(name, 'Ё', 'Е'), 'ё', 'е') as name, "
-        "  replace(keywords, 'ё', 'е') as keywords, tagkw as tag from poi "
-        "left join tag_keywords on poi.tag = tag_keywords.tag "
-        "where in_index and delete_reason is null"
-    )
-    await conn.execute("drop table tag_keywords")
+    cursor = await conn.execute(
+        "select rowid, name, keywords, tag from poi where in_index and delete_reason is null")
+    rows = [(r[0], *search_values(r[1], r[2], r[3])) async for r in cursor]
+    await conn.executemany(
+        "insert into poisearch (docid, name, keywords, tag) values (?, ?, ?, ?)", rows)
     await conn.commit()
+    await notify_poi_changed(None)
 
 
 async def get_poi_ages(poi_ids: List[int]) -> Dict[int, int]:
@@ -552,4 +764,5 @@ async def set_updated(poi_id: int, updated: str = None) -> str:
     else:
         await db.execute("update poi set updated = ? where id = ?", (updated, poi_id))
     await db.commit()
+    await notify_poi_changed(poi_id)
     return old[0]
@@ -1,3 +1,4 @@
+import copy
 from dataclasses import dataclass, field
 from typing import List, Tuple
 from raybot import config
@@ -5,7 +6,7 @@ import humanized_opening_hours as hoh
 import json
 from time import time
 from datetime import datetime
-from math import radians, cos, sqrt
+from . import geometry
 
 
 @dataclass
@@ -14,14 +15,8 @@ class Location:
     lat: float
 
     def distance(self, other) -> float:
-        """Not exact!"""
-        lat1 = radians(self.lat)
-        lat2 = radians(other.lat)
-        lon1 = radians(self.lon)
-        lon2 = radians(other.lon)
-        x = (lon2 - lon1) * cos((lat1 + lat2) / 2)
-        y = lat2 - lat1
-        return sqrt(x * x + y * y) * 6371e3
+        """Not exact! Use geometry.nearest() for lists."""
+        return geometry.distance(self.lon, self.lat, other.lon, other.lat)
 
 
 @dataclass
@@ -48,6 +43,8 @@ class POI:
     floor: str = None
     tag: str = None
     delete_reason: str = None
+    in_index: bool = True
+    open_slots: bytes = None  # see openhours.py
 
     def __init__(self, row=None, name=None, location=None, keywords=None):
         if row:
@@ -76,6 +73,8 @@ class POI:
             self.floor = row['flor']
             self.needs_check = row['needs_check'] == 1
             self.delete_reason = row['delete_reason']
+            self.in_index = row['in_index'] == 1
+            self.open_slots = row['open_slots'] if 'open_slots' in row.keys() else None
         else:
             self.id = None
             self.name = name
@@ -83,6 +82,14 @@ class POI:
             self.keywords = keywords
             self.phones = []
             self.links = []
+            self.in_index = True
+
+    def copy(self) -> 'POI':
+        """Returns a copy that can be changed without affecting a cached poi."""
+        poi = copy.copy(self)
+        poi.links = copy.deepcopy(self.links)
+        poi.phones = list(self.phones)
+        return poi
 
     def get_db_fields(self, orig=None) -> dict:
         def bool_to_int(v):
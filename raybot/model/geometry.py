@@ -0,0 +1,53 @@
+"""Vectorised geometry on arrays of coordinates. Distances are not exact:
+they use an equirectangular approximation, which is fine for a city block."""
+import numpy as np
+from math import radians, cos, sqrt
+from typing import List, Sequence, Tuple
+
+
+EARTH_RADIUS = 6371e3
+
+
+def distance(lon1: float, lat1: float, lon2: float, lat2: float) -> float:
+    """Distance in meters between two points. Plain math is faster for a single pair."""
+    x = radians(lon2 - lon1) * cos(radians(lat1 + lat2) / 2)
+    y = radians(lat2 - lat1)
+    return sqrt(x * x + y * y) * EARTH_RADIUS
+
+
+def to_arrays(locations: Sequence) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns arrays of longitudes and latitudes for a list of Location objects."""
+    lons = np.fromiter((loc.lon for loc in locations), dtype=float, count=len(locations))
+    lats = np.fromiter((loc.lat for loc in locations), dtype=float, count=len(locations))
+    return lons, lats
+
+
+def distances(lon: float, lat: float, lons: np.ndarray, lats: np.ndarray) -> np.ndarray:
+    """Distances in meters from a point to every point in the arrays."""
+    x = np.radians(lons - lon) * np.cos(np.radians(lats + lat) / 2)
+    y = np.radians(lats - lat)
+    return np.hypot(x, y) * EARTH_RADIUS
+
+
+def nearest(ref, locations: Sequence, k: int = None, max_dist: float = None) -> List[int]:
+    """Returns indices of locations sorted by distance from ref,
+    up to k of them and not farther than max_dist meters."""
+    if not locations:
+        return []
+    dist = distances(ref.lon, ref.lat, *to_arrays(locations))
+    idx = np.arange(len(dist))
+    if max_dist is not None:
+        idx = idx[dist <= max_dist]
+    if k is not None and k < len(idx):
+        idx = idx[np.argpartition(dist[idx], k - 1)[:k]]
+    idx = idx[np.argsort(dist[idx], kind='stable')]
+    return idx.tolist()
+
+
+def bounds(locations: Sequence) -> Tuple[float, float, float, float]:
+    """Returns (minlon, minlat, maxlon, maxlat), skipping empty locations."""
+    locations = [loc for loc in locations if loc]
+    if not locations:
+        return 180.0, 180.0, -180.0, -180.0
+    lons, lats = to_arrays(locations)
+    return float(lons.min()), float(lats.min()), float(lons.max()), float(lats.max())
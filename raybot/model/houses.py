@@ -0,0 +1,104 @@
+"""In-memory tree of buildings, their entrances, floors and pois, for browsing
+a house without querying SQLite. Kept current through db.add_poi_listener()."""
+from . import db
+from .entities import POI
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+
+
+@dataclass(eq=False)
+class House:
+    key: str
+    building: POI = None
+    entrances: Dict[int, str] = field(default_factory=dict)  # poi id -> str_id
+    floors: Dict[str, Dict[int, POI]] = field(default_factory=dict)  # floor -> id -> poi
+
+    def get_floors(self) -> List[str]:
+        """Same as db.get_floors_by_house(), None stands for an empty floor."""
+        return list(self.floors.keys())
+
+    def get_pois(self, floor: str = None) -> List[POI]:
+        """Same as db.get_poi_by_house(): pass '-' for floor to get only empty floors."""
+        if floor is None:
+            pois = [p for f in self.floors.values() for p in f.values()]
+        else:
+            pois = list(self.floors.get(None if floor == '-' else floor, {}).values())
+        return sorted(pois, key=lambda p: p.id)
+
+
+class HouseTree:
+    def __init__(self, pois: List[POI] = ()):
+        self.houses: Dict[str, House] = {}
+        # poi id -> (house key, kind, floor), to find the old place on updates
+        self.placed: Dict[int, Tuple[str, str, str]] = {}
+        for poi in pois:
+            self.update(poi.id, poi)
+
+    def get(self, key: str) -> House:
+        return self.houses.get(key)
+
+    def _house(self, key: str) -> House:
+        if key not in self.houses:
+            self.houses[key] = House(key)
+        return self.houses[key]
+
+    def _remove(self, poi_id: int):
+        placed = self.placed.pop(poi_id, None)
+        if not placed:
+            return
+        key, kind, floor = placed
+        house = self.houses[key]
+        if kind == 'building':
+            house.building = None
+        elif kind == 'entrance':
+            del house.entrances[poi_id]
+        else:
+            del house.floors[floor][poi_id]
+            if not house.floors[floor]:
+                del house.floors[floor]
+        if not house.building and not house.entrances and not house.floors:
+            del self.houses[key]
+
+    def update(self, poi_id: int, poi: POI):
+        self._remove(poi_id)
+        if poi is None or poi.delete_reason is not None:
+            return
+        if poi.tag == 'building':
+            if poi.key:
+                self._house(poi.key).building = poi
+                self.placed[poi_id] = (poi.key, 'building', None)
+        elif poi.tag == 'entrance':
+            if poi.house:
+                self._house(poi.house).entrances[poi_id] = poi.key
+                self.placed[poi_id] = (poi.house, 'entrance', None)
+        elif poi.house and poi.in_index:
+            self._house(poi.house).floors.setdefault(poi.floor, {})[poi_id] = poi
+            self.placed[poi_id] = (poi.house, 'poi', poi.floor)
+
+
+_tree: HouseTree = None
+_listening = False
+
+
+def _on_poi_changed(poi_id: int, poi: POI):
+    global _tree
+    if poi_id is None:
+        # Rebuild on the next request
+        _tree = None
+    elif _tree is not None:
+        _tree.update(poi_id, poi)
+
+
+async def get_house_tree() -> HouseTree:
+    global _tree, _listening
+    if not _listening:
+        db.add_poi_listener(_on_poi_changed)
+        _listening = True
+    if _tree is None:
+        conn = await db.get_db()
+        cursor = await conn.execute(
+            f"{db.POI_SELECT} where poi.delete_reason is null "
+            "and (poi.tag in ('building', 'entrance') or poi.house is not null) "
+            "order by poi.id")
+        _tree = HouseTree([POI(r) async for r in cursor])
+    return _tree
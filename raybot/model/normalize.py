@@ -0,0 +1,65 @@
+import re
+from raybot import config
+from . import stemmer
+from typing import Dict, List, Iterable
+
+
+class Normalizer:
+    """Splits, folds and stems text for both search queries and the search index.
+    Build it once from config with get_normalizer()."""
+    SPLIT_RE = re.compile(r'[\s,.+=!@#$%^&*()\'"«»<>/?`~|_-]+')
+
+    def __init__(self, skip: Iterable[str] = (), synonims: Dict[str, str] = None):
+        self.skip = frozenset(self.fold(s) for s in skip)
+        self.synonims = synonims or {}
+
+    @staticmethod
+    def fold(s: str) -> str:
+        return s.lower().replace('ё', 'е')
+
+    @staticmethod
+    def stem(token: str) -> str:
+        """Stems words, leaving numbers and codes like "mst6" intact."""
+        return stemmer.stem(token) if token.isalpha() else token
+
+    def split(self, s: str, process: bool = True, stem: bool = True) -> List[str]:
+        """Processing skips stop words, replaces synonims and stems tokens."""
+        tokens = self.SPLIT_RE.split(self.fold(s.strip()))
+        if not process:
+            return [t for t in tokens if t]
+        skip = self.skip
+        synonims = self.synonims
+        tokens = [synonims.get(t, t) for t in tokens if t and t not in skip]
+        return tokens if not stem else [self.stem(t) for t in tokens]
+
+    def index_text(self, s: str, stem: bool = True) -> str:
+        """Folds and stems a string for storing in the poisearch table."""
+        if not s:
+            return None
+        if not stem:
+            return self.fold(s)
+        return ' '.join(self.stem(t) for t in self.SPLIT_RE.split(self.fold(s)) if t)
+
+
+def reverse_synonims() -> Dict[str, str]:
+    result = {}
+    for k, v in config.RESP.get('synonims', {}).items():
+        for s in v:
+            result[s] = k
+    # Add emoji from tags
+    for k, v in config.TAGS.get('emoji', {}).items():
+        if k != 'default' and v not in result:
+            kw = config.TAGS['tags'].get(k)
+            if kw:
+                result[v] = kw[0]
+    return result
+
+
+_normalizer = None
+
+
+def get_normalizer() -> Normalizer:
+    global _normalizer
+    if _normalizer is None:
+        _normalizer = Normalizer(config.RESP.get('skip', []), reverse_synonims())
+    return _normalizer
@@ -0,0 +1,124 @@
+"""In-memory grid of live pois for nearest-neighbour queries without SQLite.
+Kept current through db.add_poi_listener()."""
+from . import db, geometry
+from .entities import POI, Location
+from typing import Dict, List, Sequence, Tuple
+from math import radians, cos
+
+
+class PoiGrid:
+    """Pois bucketed into square cells of CELL degrees."""
+    CELL = 0.001
+
+    def __init__(self, pois: Sequence[POI] = ()):
+        self.pois: Dict[int, POI] = {}
+        self.cells: Dict[Tuple[int, int], Dict[int, POI]] = {}
+        self.poi_cells: Dict[int, Tuple[int, int]] = {}
+        for poi in pois:
+            self.update(poi.id, poi)
+
+    @staticmethod
+    def is_indexed(poi: POI) -> bool:
+        """Same filter as in db.get_poi_around()."""
+        return (poi is not None and poi.location is not None and poi.delete_reason is None
+                and poi.tag not in ('building', 'entrance'))
+
+    def get_cell(self, lon: float, lat: float) -> Tuple[int, int]:
+        return int(lon // self.CELL), int(lat // self.CELL)
+
+    def update(self, poi_id: int, poi: POI):
+        cell = self.poi_cells.pop(poi_id, None)
+        if cell is not None:
+            del self.cells[cell][poi_id]
+            if not self.cells[cell]:
+                del self.cells[cell]
+            del self.pois[poi_id]
+        if self.is_indexed(poi):
+            cell = self.get_cell(poi.location.lon, poi.location.lat)
+            self.cells.setdefault(cell, {})[poi_id] = poi
+            self.poi_cells[poi_id] = cell
+            self.pois[poi_id] = poi
+
+    def get(self, poi_ids: Sequence[int]) -> List[POI]:
+        """Returns indexed pois in the given order, skipping unknown ids."""
+        return [self.pois[i] for i in poi_ids if i in self.pois]
+
+    def _ring(self, cx: int, cy: int, ring: int, floor: str = None) -> List[POI]:
+        result = []
+        for x in range(cx - ring, cx + ring + 1):
+            edge = x == cx - ring or x == cx + ring
+            for y in range(cy - ring, cy + ring + 1, 1 if edge else 2 * ring):
+                for poi in self.cells.get((x, y), {}).values():
+                    if floor is None or poi.floor == (None if floor == '-' else floor):
+                        result.append(poi)
+        return result
+
+    def nearest(self, loc: Location, k: int = 10, floor: str = None,
+                max_dist: float = None) -> List[POI]:
+        """Returns up to k pois sorted by distance. Pass '-' for floor
+        to get only pois with an empty floor."""
+        if not self.cells:
+            return []
+        cx, cy = self.get_cell(loc.lon, loc.lat)
+        xs = [c[0] for c in self.cells]
+        ys = [c[1] for c in self.cells]
+        max_ring = max(abs(cx - min(xs)), abs(cx - max(xs)), abs(cy - min(ys)), abs(cy - max(ys)))
+        # Everything outside the rings searched so far is at least this far
+        cell_m = geometry.EARTH_RADIUS * radians(self.CELL) * cos(radians(abs(loc.lat) + self.CELL))
+        candidates = []
+        ring = 0
+        while True:
+            candidates.extend(self._ring(cx, cy, ring, floor))
+            reach = ring * cell_m
+            if ring >= max_ring or (max_dist is not None and reach >= max_dist):
+                break
+            if len(candidates) >= k:
+                idx = geometry.nearest(loc, [p.location for p in candidates], k=k)
+                if loc.distance(candidates[idx[-1]].location) <= reach:
+                    break
+            ring += 1
+        idx = geometry.nearest(loc, [p.location for p in candidates], k=k, max_dist=max_dist)
+        return [candidates[i] for i in idx]
+
+    def within(self, bbox: Sequence[float]) -> List[POI]:
+        """Returns pois inside [minlon, minlat, maxlon, maxlat]."""
+        xmin, ymin = self.get_cell(bbox[0], bbox[1])
+        xmax, ymax = self.get_cell(bbox[2], bbox[3])
+        result = []
+        if (xmax - xmin + 1) * (ymax - ymin + 1) > len(self.cells):
+            cells = [c for c in self.cells if xmin <= c[0] <= xmax and ymin <= c[1] <= ymax]
+        else:
+            cells = [(x, y) for x in range(xmin, xmax + 1) for y in range(ymin, ymax + 1)]
+        for cell in cells:
+            for poi in self.cells.get(cell, {}).values():
+                if (bbox[0] <= poi.location.lon <= bbox[2] and
+                        bbox[1] <= poi.location.lat <= bbox[3]):
+                    result.append(poi)
+        return result
+
+
+_grid: PoiGrid = None
+_listening = False
+
+
+def _on_poi_changed(poi_id: int, poi: POI):
+    global _grid
+    if poi_id is None:
+        # Rebuild on the next request
+        _grid = None
+    elif _grid is not None:
+        _grid.update(poi_id, poi)
+
+
+async def get_poi_grid() -> PoiGrid:
+    global _grid, _listening
+    if not _listening:
+        db.add_poi_listener(_on_poi_changed)
+        _listening = True
+    if _grid is None:
+        conn = await db.get_db()
+        cursor = await conn.execute(
+            f"{db.POI_SELECT} where poi.delete_reason is null "
+            "and (poi.tag is null or poi.tag not in ('building', 'entrance'))")
+        _grid = PoiGrid([POI(r) async for r in cursor])
+    return _grid
@@ -0,0 +1,144 @@
+"""Spelling correction for search tokens with a symmetric-delete dictionary
+of words from the search index. Kept current through db.add_poi_listener()."""
+from . import db
+from .entities import POI
+from .normalize import get_normalizer
+from collections import Counter, OrderedDict
+from typing import Dict, Iterable, List, Set
+
+
+def max_distance(word: str) -> int:
+    if len(word) < 4:
+        return 0
+    return 1 if len(word) < 7 else 2
+
+
+def deletes(word: str, distance: int) -> Set[str]:
+    """Returns all strings made by deleting up to distance letters."""
+    result = {word}
+    edge = {word}
+    for _ in range(distance):
+        edge = {w[:i] + w[i + 1:] for w in edge for i in range(len(w))}
+        result |= edge
+    return result
+
+
+def edit_distance(a: str, b: str) -> int:
+    """Levenshtein distance with adjacent transpositions."""
+    prev2 = None
+    prev = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        cur = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                cur[j] = min(cur[j], prev2[j - 2] + 1)
+        prev2, prev = prev, cur
+    return prev[len(b)]
+
+
+class Speller:
+    CORRECTIONS_SIZE = 10000
+
+    def __init__(self):
+        self.words: Counter = Counter()  # word -> number of pois with it
+        self.deletes: Dict[str, Set[str]] = {}  # deleted form -> words
+        self.poi_words: Dict[int, Set[str]] = {}
+        # Token -> correction, most recently used last, cleared on every change
+        self.corrections: OrderedDict = OrderedDict()
+
+    @staticmethod
+    def get_words(values: Iterable[str]) -> Set[str]:
+        norm = get_normalizer()
+        return {w for v in values if v for w in norm.split(v, process=False)
+                if w.isalpha()}
+
+    def _add_word(self, word: str):
+        self.words[word] += 1
+        if self.words[word] == 1:
+            for d in deletes(word, max_distance(word)):
+                self.deletes.setdefault(d, set()).add(word)
+
+    def _remove_word(self, word: str):
+        self.words[word] -= 1
+        if self.words[word] <= 0:
+            del self.words[word]
+            for d in deletes(word, max_distance(word)):
+                self.deletes[d].discard(word)
+                if not self.deletes[d]:
+                    del self.deletes[d]
+
+    def update(self, poi_id: int, poi: POI):
+        self.corrections.clear()
+        for word in self.poi_words.pop(poi_id, ()):
+            self._remove_word(word)
+        if poi is None or poi.delete_reason is not None or not poi.in_index:
+            return
+        self.set_words(poi_id, db.search_values(poi.name, poi.keywords, poi.tag))
+
+    def set_words(self, poi_id: int, values: Iterable[str]):
+        self.corrections.clear()
+        words = self.get_words(values)
+        self.poi_words[poi_id] = words
+        for word in words:
+            self._add_word(word)
+
+    def correct(self, token: str) -> str:
+        """Returns the closest known word, or the token itself."""
+        if token in self.words or not token.isalpha():
+            return token
+        if token in self.corrections:
+            self.corrections.move_to_end(token)
+            return self.corrections[token]
+        result = self.corrections[token] = self._correct(token)
+        while len(self.corrections) > self.CORRECTIONS_SIZE:
+            self.corrections.popitem(last=False)
+        return result
+
+    def _correct(self, token: str) -> str:
+        distance = max_distance(token)
+        if not distance:
+            return token
+        candidates = set()
+        for d in deletes(token, distance):
+            candidates.update(self.deletes.get(d, ()))
+        best = None
+        for word in candidates:
+            dist = edit_distance(token, word)
+            if dist <= distance:
+                key = (dist, -self.words[word], word)
+                if best is None or key < best:
+                    best = key
+        return token if best is None else best[2]
+
+    def correct_tokens(self, tokens: List[str]) -> List[str]:
+        return [self.correct(t) for t in tokens]
+
+
+_speller: Speller = None
+_listening = False
+
+
+def _on_poi_changed(poi_id: int, poi: POI):
+    global _speller
+    if poi_id is None:
+        # Rebuild on the next request
+        _speller = None
+    elif _speller is not None:
+        _speller.update(poi_id, poi)
+
+
+async def get_speller() -> Speller:
+    global _speller, _listening
+    if not _listening:
+        db.add_poi_listener(_on_poi_changed)
+        _listening = True
+    if _speller is None:
+        conn = await db.get_db()
+        cursor = await conn.execute("select docid, name, keywords, tag from poisearch")
+        speller = Speller()
+        async for row in cursor:
+            speller.set_words(row[0], row[1:])
+        _speller = speller
+    return _speller
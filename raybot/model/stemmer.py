@@ -0,0 +1,83 @@
+"""Russian stemmer following the Snowball algorithm:
+https://snowballstem.org/algorithms/russian/stemmer.html
+Expects folded words (lowercase, ё replaced with е)."""
+import re
+from functools import lru_cache
+
+
+VOWELS = frozenset('аеиоуыэюя')
+
+# Group 1 endings must follow "а" or "я", which stays in the word
+PERFECTIVE_GERUND = re.compile(r'(?:(?<=[ая])(?:в|вши|вшись)|ив|ивши|ившись|ыв|ывши|ывшись)$')
+REFLEXIVE = re.compile(r'(?:ся|сь)$')
+ADJECTIVE = re.compile(r'(?:ее|ие|ые|ое|ими|ыми|ей|ий|ый|ой|ем|им|ым|ом|его|ого|ему|ому'
+                       r'|их|ых|ую|юю|ая|яя|ою|ею)$')
+PARTICIPLE = re.compile(r'(?:(?<=[ая])(?:ем|нн|вш|ющ|щ)|ивш|ывш|ующ)$')
+VERB = re.compile(r'(?:(?<=[ая])(?:ла|на|ете|йте|ли|й|л|ем|н|ло|но|ет|ют|ны|ть|ешь|нно)'
+                  r'|ила|ыла|ена|ейте|уйте|ите|или|ыли|ей|уй|ил|ыл|им|ым|ен|ило|ыло|ено'
+                  r'|ят|ует|уют|ит|ыт|ены|ить|ыть|ишь|ую|ю)$')
+NOUN = re.compile(r'(?:а|ев|ов|ие|ье|е|иями|ями|ами|еи|ии|и|ией|ей|ой|ий|й|иям|ям|ием|ем'
+                  r'|ам|ом|о|у|ах|иях|ях|ы|ь|ию|ью|ю|ия|ья|я)$')
+DERIVATIONAL = re.compile(r'(?:ост|ость)$')
+SUPERLATIVE = re.compile(r'(?:ейш|ейше)$')
+
+
+def _region(word: str, start: int) -> int:
+    """Returns the index after the first non-vowel following a vowel, from start."""
+    for i in range(start + 1, len(word)):
+        if word[i] not in VOWELS and word[i - 1] in VOWELS:
+            return i + 1
+    return len(word)
+
+
+def _cut(pattern: re.Pattern, s: str) -> str:
+    """Removes the pattern from the end of s, returns None if it is not there."""
+    m = pattern.search(s)
+    return None if not m else s[:m.start()]
+
+
+@lru_cache(maxsize=50000)
+def stem(word: str) -> str:
+    rv_start = next((i + 1 for i, c in enumerate(word) if c in VOWELS), len(word))
+    r2_start = _region(word, _region(word, 0))
+    prefix, rv = word[:rv_start], word[rv_start:]
+    if not rv:
+        return word
+
+    # Step 1: one grammatical ending
+    cut = _cut(PERFECTIVE_GERUND, rv)
+    if cut is None:
+        cut = _cut(REFLEXIVE, rv)
+        if cut is not None:
+            rv = cut
+        cut = _cut(ADJECTIVE, rv)
+        if cut is not None:
+            participle = _cut(PARTICIPLE, cut)
+            if participle is not None:
+                cut = participle
+        else:
+            cut = _cut(VERB, rv)
+            if cut is None:
+                cut = _cut(NOUN, rv)
+    if cut is not None:
+        rv = cut
+
+    # Step 2
+    if rv.endswith('и'):
+        rv = rv[:-1]
+
+    # Step 3: derivational ending fully inside R2
+    m = DERIVATIONAL.search(rv)
+    if m and m.start() + rv_start >= r2_start:
+        rv = rv[:m.start()]
+
+    # Step 4
+    if rv.endswith('нн'):
+        rv = rv[:-1]
+    else:
+        cut = _cut(SUPERLATIVE, rv)
+        if cut is not None:
+            rv = cut[:-1] if cut.endswith('нн') else cut
+        elif rv.endswith('ь'):
+            rv = rv[:-1]
+    return prefix + rv
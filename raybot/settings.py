@@ -13,11 +13,15 @@ class Config:
         # Configuration options
         CONFIG = self.merge_yamls('config.yml', ALT_CONFIG_DIR)
         self.TELEGRAM_TOKEN = CONFIG.get('telegram_token')
+        self.TELEGRAM_API = CONFIG.get('telegram_api')
         self.ADMIN = CONFIG.get('admin_id')
         self.LOGS = self.rel_expand(CONFIG.get('logs', BASE_DIR), ALT_CONFIG_DIR)
         self.MAINTENANCE = CONFIG.get('maintenance', False)
         self.BBOX = CONFIG.get('bbox')
         self.PRUNE_TIMEOUT = int(CONFIG.get('prune_timeout', 10))
+        self.METRICS_PORT = CONFIG.get('metrics_port')
+        self.SLOW_QUERY_MS = int(CONFIG.get('slow_query_ms', 100))
+        self.DEBUG_BLOCKING_MS = int(CONFIG.get('debug_blocking_ms', 0))
         language = CONFIG.get('language', 'ru')
 
         # Common paths
@@ -25,6 +29,8 @@ class Config:
             CONFIG.get('database', 'raybot.sqlite'), ALT_CONFIG_DIR)
         self.PHOTOS = self.rel_expand(CONFIG.get('photos', 'photo'), ALT_CONFIG_DIR)
         self.TILES = self.rel_expand(CONFIG.get('tiles', 'tiles'), ALT_CONFIG_DIR)
+        self.TILE_CACHE = self.rel_expand(CONFIG.get('tile_cache'), ALT_CONFIG_DIR)
+        self.MAP_CACHE = self.rel_expand(CONFIG.get('map_cache'), ALT_CONFIG_DIR)
         logging.debug(f'Photos: {self.PHOTOS}, tiles: {self.TILES}')
 
         # Strings and lists
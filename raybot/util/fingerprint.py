@@ -0,0 +1,114 @@
+"""Photo fingerprints: an exact hash of the pixels and a perceptual hash
+for near-duplicates. Fingerprints are stored in the database and computed
+in a process pool only for files that changed since the last run."""
+import asyncio
+import hashlib
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from PIL import Image
+from raybot import config
+from raybot.model import db
+from typing import Dict, List, Sequence, Tuple
+
+
+# Photos per task sent to a worker process
+CHUNK = 32
+# Perceptual hashes this many bits apart are considered near-duplicates
+NEAR_DISTANCE = 4
+
+
+@dataclass(eq=False)
+class Fingerprint:
+    md5: str
+    phash: int
+
+
+def compute(path: str) -> Tuple[str, str]:
+    """Returns the MD5 of decoded pixels and a 64-bit difference hash, both in hex."""
+    image = Image.open(path)
+    md5 = hashlib.md5(image.tobytes()).hexdigest()
+    # The difference hash compares neighbouring pixels of a 9×8 thumbnail
+    pixels = list(image.convert('L').resize((9, 8), Image.BILINEAR).getdata())
+    dhash = 0
+    for row in range(8):
+        for col in range(8):
+            dhash = (dhash << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return md5, f'{dhash:016x}'
+
+
+def _compute_chunk(paths: List[str]) -> List[Tuple[str, str]]:
+    return [compute(p) for p in paths]
+
+
+async def fingerprint(names: Sequence[str]) -> Dict[str, Fingerprint]:
+    """Returns fingerprints for photo names that exist on disk."""
+    stored = await db.get_photo_hashes()
+    result = {}
+    changed = []
+    for name in names:
+        path = os.path.join(config.PHOTOS, name + '.jpg')
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            continue
+        row = stored.get(name)
+        if row and row[0] == st.st_size and row[1] == st.st_mtime:
+            result[name] = Fingerprint(row[2], int(row[3], 16))
+        else:
+            changed.append((name, path, st))
+
+    if changed:
+        loop = asyncio.get_running_loop()
+        # Forking would copy the database and watchdog threads into workers
+        with ProcessPoolExecutor(mp_context=multiprocessing.get_context('spawn')) as pool:
+            chunks = [changed[i:i + CHUNK] for i in range(0, len(changed), CHUNK)]
+            hashes = await asyncio.gather(*[
+                loop.run_in_executor(pool, _compute_chunk, [c[1] for c in chunk])
+                for chunk in chunks])
+        rows = []
+        for chunk, chunk_hashes in zip(chunks, hashes):
+            for (name, _, st), (md5, phash) in zip(chunk, chunk_hashes):
+                result[name] = Fingerprint(md5, int(phash, 16))
+                rows.append((name, st.st_size, st.st_mtime, md5, phash))
+        await db.store_photo_hashes(rows)
+    return result
+
+
+def near_duplicates(prints: Dict[str, Fingerprint],
+                    distance: int = NEAR_DISTANCE) -> List[List[str]]:
+    """Groups photos with perceptual hashes at most distance bits apart,
+    excluding exact duplicates. Two hashes that close share at least one
+    of distance+1 bands exactly, so only photos in the same band are compared."""
+    bands = distance + 1
+    width = 64 // bands + 1
+    buckets: Dict[Tuple[int, int], List[str]] = {}
+    for name, fp in prints.items():
+        for band in range(bands):
+            key = (band, (fp.phash >> (band * width)) & ((1 << width) - 1))
+            buckets.setdefault(key, []).append(name)
+
+    # Union-find over similar pairs
+    parent = {}
+
+    def find(n):
+        while parent.get(n, n) != n:
+            n = parent[n]
+        return n
+
+    for names in buckets.values():
+        for i, a in enumerate(names):
+            for b in names[i + 1:]:
+                pa, pb = prints[a], prints[b]
+                if pa.md5 != pb.md5 and bin(pa.phash ^ pb.phash).count('1') <= distance:
+                    parent[find(b)] = find(a)
+
+    groups: Dict[str, List[str]] = {}
+    for name in parent:
+        groups.setdefault(find(name), [])
+    for name in prints:
+        root = find(name)
+        if root in groups:
+            groups[root].append(name)
+    return [sorted(g) for g in groups.values() if len(g) > 1]
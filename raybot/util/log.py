@@ -1,8 +1,27 @@
-from raybot import config
+from raybot import config, metrics
 import os
+import time
+from contextvars import ContextVar
 from datetime import datetime
-from aiogram import types
-from aiogram.dispatcher.middlewares import LifetimeControllerMiddleware
+from typing import Dict
+from aiogram import Bot, types
+from aiogram.bot import api
+from aiogram.dispatcher.handler import current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware, LifetimeControllerMiddleware
+
+
+# update_id -> time when getUpdates returned the update
+_received: Dict[int, float] = {}
+# (handler name, start time) for the update processed in the current context
+_handler: ContextVar[tuple] = ContextVar('handler', default=None)
+
+metrics.describe('telegram_seconds', 'Bot API requests, except for getUpdates')
+metrics.describe('update_queue_seconds', 'Time between receiving an update and processing it')
+metrics.describe('update_seconds', 'Processing an update, including middlewares')
+metrics.describe('handler_seconds', 'Running a handler')
+metrics.describe('update_db_seconds', 'Database time spent on an update')
+metrics.describe('update_telegram_seconds', 'Bot API time spent on an update')
+metrics.describe('action_seconds', 'Common actions like printing a poi')
 
 
 class LoggingMiddleware(LifetimeControllerMiddleware):
@@ -22,3 +41,52 @@ class LoggingMiddleware(LifetimeControllerMiddleware):
         with open(os.path.join(config.LOGS, 'access.log'), 'a') as f:
             now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
             f.write(f'{now}\t{user_id}\t{typ}\n')
+
+
+class InstrumentedBot(Bot):
+    """Records Bot API request durations and notes when updates arrive."""
+    async def request(self, method, data=None, files=None, **kwargs):
+        start = time.perf_counter()
+        try:
+            result = await super().request(method, data, files, **kwargs)
+        finally:
+            if method != api.Methods.GET_UPDATES:
+                duration = time.perf_counter() - start
+                metrics.observe('telegram_seconds', duration, {'method': method})
+                metrics.add_time('telegram', duration)
+        if method == api.Methods.GET_UPDATES and result:
+            if len(_received) > 10000:
+                # Skipped updates never get processed
+                _received.clear()
+            now = time.perf_counter()
+            for update in result:
+                _received[update['update_id']] = now
+        return result
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """Records handler wall time, queue wait, database and Bot API time for each update."""
+    async def trigger(self, action, args):
+        if action == 'pre_process_update':
+            now = time.perf_counter()
+            received = _received.pop(args[0].update_id, None)
+            if received is not None:
+                metrics.observe('update_queue_seconds', now - received)
+            metrics.start_update()['start'] = now
+        elif action == 'post_process_update':
+            times = metrics.update_times()
+            if times is None:
+                return
+            now = time.perf_counter()
+            handler = _handler.get()
+            labels = {'handler': 'none' if not handler else handler[0]}
+            metrics.observe('update_seconds', now - times['start'], labels)
+            if handler:
+                metrics.observe('handler_seconds', now - handler[1], labels)
+            metrics.observe('update_db_seconds', times.get('db', 0), labels)
+            metrics.observe('update_telegram_seconds', times.get('telegram', 0), labels)
+        elif action.startswith('process_') and action != 'process_update':
+            # Called before each handler whose filters have passed
+            handler = current_handler.get()
+            if handler:
+                _handler.set((handler.__name__, time.perf_counter()))
@@ -0,0 +1,74 @@
+"""Event loop monitoring: a lag sampler, and a watchdog thread that logs
+the stack of whatever blocks the loop for longer than a threshold."""
+from raybot import metrics
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from typing import List
+
+
+LAG_INTERVAL = 0.1
+
+metrics.describe('event_loop_lag_seconds', 'Delay of a timer callback on the event loop')
+metrics.describe('event_loop_blocked_total', 'Times the event loop was blocked over the threshold')
+
+
+async def sample_lag(interval: float = LAG_INTERVAL, samples: List[float] = None):
+    """Runs until cancelled, measuring how late the loop wakes up from a sleep."""
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - expected)
+        metrics.observe('event_loop_lag_seconds', lag)
+        if samples is not None:
+            samples.append(lag)
+
+
+class BlockingDetector(threading.Thread):
+    """Logs a warning with the loop thread stack when the loop does not
+    run a heartbeat callback for threshold_ms. Start it from the loop thread."""
+    def __init__(self, threshold_ms: int):
+        super().__init__(name='BlockingDetector', daemon=True)
+        self.threshold = threshold_ms / 1000
+        self.interval = self.threshold / 4
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread = threading.get_ident()
+        self.last_beat = time.monotonic()
+        self.reported = False
+        self.stopped = False
+
+    def beat(self):
+        now = time.monotonic()
+        if self.reported:
+            logging.warning('Event loop was blocked for %.0f ms in total',
+                            (now - self.last_beat - self.interval) * 1000)
+            self.reported = False
+        self.last_beat = now
+        if not self.stopped:
+            self.loop.call_later(self.interval, self.beat)
+
+    def start(self):
+        self.loop.call_soon(self.beat)
+        super().start()
+
+    def stop(self):
+        self.stopped = True
+
+    def run(self):
+        while not self.stopped:
+            time.sleep(self.interval)
+            # The next beat is due an interval after the last one
+            blocked = time.monotonic() - self.last_beat - self.interval
+            if blocked < self.threshold or self.reported:
+                continue
+            frame = sys._current_frames().get(self.loop_thread)
+            if frame is None:
+                continue
+            self.reported = True
+            metrics.inc('event_loop_blocked_total')
+            logging.warning('Event loop blocked for %.0f ms at:\n%s', blocked * 1000,
+                            ''.join(traceback.format_stack(frame)))
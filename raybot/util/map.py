@@ -1,15 +1,25 @@
 from PIL import Image, ImageDraw, ImageFont
 from typing import Sequence
+import hashlib
+import io
 import math
 import os
 import tempfile
 import logging
 from raybot import config
-from raybot.model import Location
+from raybot.model import Location, geometry
+from .tiles import get_tile_store
 
 
 zooms = None
 cached_tiles = {}
+# Change when maps start to look different, so that cached maps are not used
+MAP_VERSION = 1
+
+
+class MapImage(io.BytesIO):
+    """JPEG contents of a map. Pass it to types.InputFile with the filename."""
+    name = 'map.jpg'
 
 
 def deg2num(lon_deg, lat_deg, zoom):
@@ -22,9 +32,8 @@ def deg2num(lon_deg, lat_deg, zoom):
 
 def get_zooms():
     global zooms
-    if zooms or not os.path.exists(config.TILES):
-        return zooms
-    zooms = sorted([int(z) for z in os.listdir(config.TILES) if z.isdecimal()])
+    if not zooms:
+        zooms = get_tile_store().get_zooms()
     return zooms
 
 
@@ -32,13 +41,14 @@ def load_tile(zoom, x, y, tilesize=256):
     k = f'{zoom},{x},{y}'
     if k in cached_tiles:
         return cached_tiles[k]
-    path = os.path.join(config.TILES, str(zoom), str(x), f'{y}.png')
+    data = get_tile_store().get_tile(zoom, x, y)
     tile = None
-    if os.path.exists(path):
+    if data:
         try:
-            tile = Image.open(path)
+            tile = Image.open(io.BytesIO(data))
+            tile.load()
         except IOError:
-            pass
+            tile = None
     found = tile is not None
     if not found:
         tile = Image.new("RGBA", (tilesize, tilesize), color='#ffeeee')
@@ -46,7 +56,11 @@ def load_tile(zoom, x, y, tilesize=256):
     return (tile, found)
 
 
-def merge_tiles(xmin, ymin, xmax, ymax, zoom, tilesize=256):
+def compose_tiles(left, top, right, bottom, zoom, tilesize=256):
+    """Builds an image for a viewport given in global pixel coordinates.
+    Allocates only the viewport and pastes tiles clipped to it."""
+    xmin, xmax = left // tilesize, (right - 1) // tilesize
+    ymin, ymax = top // tilesize, (bottom - 1) // tilesize
     xsize = xmax - xmin + 1
     ysize = ymax - ymin + 1
     if xsize * ysize > 20:
@@ -55,11 +69,12 @@ def merge_tiles(xmin, ymin, xmax, ymax, zoom, tilesize=256):
         return None
 
     found_any = False
-    image = Image.new("RGBA", (xsize * tilesize, ysize * tilesize))
+    image = Image.new("RGBA", (right - left, bottom - top))
     for x in range(xmin, xmax + 1):
         for y in range(ymin, ymax + 1):
             tile, found = load_tile(zoom, x, y)
-            image.paste(tile, ((x - xmin) * tilesize, (y - ymin) * tilesize))
+            # Pasting with a negative offset copies only the visible part
+            image.paste(tile, (x * tilesize - left, y * tilesize - top))
             if found:
                 found_any = True
     return image if found_any else None
@@ -85,52 +100,76 @@ def build_basemap(minlon, minlat, maxlon, maxlat, gutter=100,
 
     txmin = int(xmin - 1.0 * gutter / tilesize)
     tymin = int(ymin - 1.0 * gutter / tilesize)
-    txmax = int(xmax + 1.0 * gutter / tilesize)
-    tymax = int(ymax + 1.0 * gutter / tilesize)
-    image = merge_tiles(txmin, tymin, txmax, tymax, zoom)
+    cxmin = txmin * tilesize + int((xmin - txmin) * tilesize) - gutter
+    cymin = tymin * tilesize + int((ymin - tymin) * tilesize) - gutter
+    cxmax = txmin * tilesize + int((xmax - txmin) * tilesize) + gutter
+    cymax = tymin * tilesize + int((ymax - tymin) * tilesize) + gutter
+    image = compose_tiles(cxmin, cymin, cxmax, cymax, zoom)
     if not image:
         return None
 
-    cxmin = int((xmin - txmin) * tilesize) - gutter
-    cymin = int((ymin - tymin) * tilesize) - gutter
-    cxmax = int((xmax - txmin) * tilesize) + gutter
-    cymax = int((ymax - tymin) * tilesize) + gutter
-    image = image.crop((cxmin, cymin, cxmax, cymax))
-
     def get_xy(lon, lat):
         tx, ty = deg2num(lon, lat, zoom)
         return (
-            round((tx - txmin) * tilesize - cxmin),
-            round((ty - tymin) * tilesize - cymin)
+            round(tx * tilesize - cxmin),
+            round(ty * tilesize - cymin)
         )
     return image, get_xy
 
 
 def find_bounds(coords):
-    minlon, minlat = 180.0, 180.0
-    maxlon, maxlat = -180.0, -180.0
-    for c in coords:
-        if not c:
-            continue
-        if c.lon < minlon:
-            minlon = c.lon
-        if c.lon > maxlon:
-            maxlon = c.lon
-        if c.lat < minlat:
-            minlat = c.lat
-        if c.lat > maxlat:
-            maxlat = c.lat
-    return minlon, minlat, maxlon, maxlat
-
-
-def get_map(coords: Sequence[Location], ref: Location = None):
+    return geometry.bounds(coords)
+
+
+def get_map_cache_path(coords: Sequence[Location], ref: Location = None) -> str:
+    """Returns a path in the map cache, addressed by the map contents."""
+    if not config.MAP_CACHE:
+        return None
+    key = ';'.join(f'{c.lon:.6f},{c.lat:.6f}' for c in coords)
+    if ref:
+        key += f'|{ref.lon:.6f},{ref.lat:.6f}'
+    digest = hashlib.sha1(f'{MAP_VERSION}|{key}'.encode()).hexdigest()
+    return os.path.join(config.MAP_CACHE, digest[:2], digest + '.jpg')
+
+
+def cache_map(coords: Sequence[Location], ref: Location = None) -> bool:
+    """Renders a map into the map cache. Returns False if there is nothing to render."""
+    path = get_map_cache_path(coords, ref)
+    fp = None if not path else render_map(coords, ref)
+    if not fp:
+        return False
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), delete=False) as f:
+        f.write(fp.getbuffer())
+    os.replace(f.name, path)
+    return True
+
+
+def get_map(coords: Sequence[Location], ref: Location = None, to_file: bool = False):
+    """Returns a MapImage buffer, or a named temporary file if to_file is set.
+    Maps from the map cache are returned without rendering."""
+    if not coords:
+        return None
+    path = get_map_cache_path(coords, ref)
+    if path and os.path.exists(path):
+        fp = tempfile.NamedTemporaryFile(suffix='.jpg', prefix='raybot-map-') \
+            if to_file else MapImage()
+        with open(path, 'rb') as f:
+            fp.write(f.read())
+        fp.seek(0)
+        return fp
+    return render_map(coords, ref, to_file)
+
+
+def render_map(coords: Sequence[Location], ref: Location = None, to_file: bool = False):
     if not coords:
         return None
     minlon, minlat, maxlon, maxlat = find_bounds(coords + [ref])
     gutter = 200 if len(coords) > 1 else 300
-    image, get_xy = build_basemap(minlon, minlat, maxlon, maxlat, gutter=gutter, maxzoom=17)
-    if not image:
+    basemap = build_basemap(minlon, minlat, maxlon, maxlat, gutter=gutter, maxzoom=17)
+    if not basemap:
         return None
+    image, get_xy = basemap
 
     draw = ImageDraw.Draw(image)
     draw.text((5, image.height - 15), '© OpenStreetMap', fill='#0f0f0f', anchor='ls')
@@ -152,7 +191,10 @@ def get_map(coords: Sequence[Location], ref: Location = None):
         draw.ellipse([(x - 8, y - 8), (x + 8, y + 8)], outline='#F51342', fill='#ffffff')
         draw.ellipse([(x - 5, y - 5), (x + 5, y + 5)], fill='#F51342')
 
-    fp = tempfile.NamedTemporaryFile(suffix='.jpg', prefix='raybot-map-')
+    if to_file:
+        fp = tempfile.NamedTemporaryFile(suffix='.jpg', prefix='raybot-map-')
+    else:
+        fp = MapImage()
     image.convert('RGB').save(fp, 'JPEG', quality=80)
     fp.seek(0)
     return fp
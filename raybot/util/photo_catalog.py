@@ -0,0 +1,79 @@
+import os
+from dataclasses import dataclass
+from typing import Dict, Sequence, Union
+from aiogram import types
+from raybot import config
+from raybot.model import db
+
+
+@dataclass
+class Photo:
+    name: str
+    path: str
+    size: int
+    file_id: str = None
+
+    def input_file(self) -> Union[str, types.InputFile]:
+        """Returns what can be passed to send_photo."""
+        return self.file_id or types.InputFile(self.path)
+
+
+# File path -> size. Missing files are not cached, since photos can be copied in any time
+_sizes: Dict[str, int] = {}
+# Photo name -> (size, file_id or None)
+_file_ids: Dict[str, tuple] = {}
+
+
+def get_path(name: str, ext: str = '.jpg') -> str:
+    return os.path.join(config.PHOTOS, name + ext)
+
+
+def _get_size(path: str) -> int:
+    size = _sizes.get(path)
+    if size is None:
+        try:
+            size = _sizes[path] = os.path.getsize(path)
+        except OSError:
+            return None
+    return size
+
+
+async def resolve(names: Sequence[str], ext: str = '.jpg') -> Dict[str, Photo]:
+    """Returns photos for names that exist on disk, with cached file_ids.
+    Stats every file once, and makes at most one query for unknown file_ids.
+    Use ext='' for names that already have an extension."""
+    result = {}
+    unknown = {}
+    for name in names:
+        if not name or name in result:
+            continue
+        path = get_path(name, ext)
+        size = _get_size(path)
+        if size is None:
+            continue
+        photo = Photo(name, path, size)
+        cached = _file_ids.get(name)
+        if cached and cached[0] == size:
+            photo.file_id = cached[1]
+        else:
+            unknown[name] = size
+        result[name] = photo
+
+    if unknown:
+        file_ids = await db.find_file_ids(unknown)
+        for name, size in unknown.items():
+            file_id = file_ids.get(name)
+            _file_ids[name] = (size, file_id)
+            result[name].file_id = file_id
+    return result
+
+
+async def store_file_id(photo: Photo, file_id: str):
+    _file_ids[photo.name] = (photo.size, file_id)
+    await db.store_file_id(photo.name, photo.size, file_id)
+
+
+def forget(name: str, ext: str = '.jpg'):
+    """Call after uploading or deleting a photo file."""
+    _sizes.pop(get_path(name, ext), None)
+    _file_ids.pop(name, None)
@@ -0,0 +1,103 @@
+"""On-demand profiling of the running bot: cProfile and tracemalloc
+over a time window, with results returned as files to send."""
+import asyncio
+import cProfile
+import io
+import marshal
+import pstats
+import tracemalloc
+from typing import List, Tuple
+
+
+TOP_LINES = 50
+TRACEBACK_FRAMES = 15
+# Only one profiler can run at a time
+_busy = False
+
+
+class ProfilerBusy(Exception):
+    """Raised when another profile is being collected."""
+
+
+def _acquire():
+    global _busy
+    if _busy:
+        raise ProfilerBusy('Profiling is already in progress')
+    _busy = True
+
+
+async def profile_cpu(seconds: float) -> Tuple[io.BytesIO, io.StringIO]:
+    """Profiles the event loop thread for the given time. Returns the pstats dump
+    and a text report sorted by cumulative time. Raises ProfilerBusy when busy."""
+    global _busy
+    _acquire()
+    prof = cProfile.Profile()
+    try:
+        prof.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            prof.disable()
+    finally:
+        _busy = False
+
+    prof.create_stats()
+    dump = io.BytesIO()
+    # Same as Profile.dump_stats(), which only writes to a named file
+    dump.write(marshal.dumps(prof.stats))
+    dump.seek(0)
+
+    report = io.StringIO()
+    report.write(f'Profiled for {seconds:g} seconds\n')
+    stats = pstats.Stats(prof, stream=report)
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(TOP_LINES)
+    stats.sort_stats(pstats.SortKey.TIME).print_stats(TOP_LINES)
+    report.seek(0)
+    return dump, report
+
+
+def _format_diff(stats: List[tracemalloc.StatisticDiff], by_traceback: bool) -> List[str]:
+    lines = []
+    for stat in stats[:TOP_LINES if not by_traceback else 10]:
+        if not by_traceback:
+            lines.append(str(stat))
+        else:
+            lines.append(f'{stat.size_diff / 1024:+.1f} KiB in {stat.count_diff:+d} blocks')
+            lines.extend(stat.traceback.format())
+            lines.append('')
+    return lines
+
+
+async def memory_diff(seconds: float) -> io.StringIO:
+    """Compares tracemalloc snapshots taken the given time apart.
+    Returns a text report of the allocations that grew the most.
+    Raises ProfilerBusy when busy."""
+    global _busy
+    _acquire()
+    started = not tracemalloc.is_tracing()
+    try:
+        if started:
+            tracemalloc.start(TRACEBACK_FRAMES)
+        before = tracemalloc.take_snapshot()
+        await asyncio.sleep(seconds)
+        after = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        if started:
+            tracemalloc.stop()
+        _busy = False
+
+    # Skip the snapshot machinery itself
+    filters = [tracemalloc.Filter(False, tracemalloc.__file__)]
+    before = before.filter_traces(filters)
+    after = after.filter_traces(filters)
+    lines = [
+        f'Memory allocations over {seconds:g} seconds',
+        f'Traced now: {current / 1024:.1f} KiB, peak: {peak / 1024:.1f} KiB',
+        '',
+        'Top lines:',
+    ]
+    lines.extend(_format_diff(after.compare_to(before, 'lineno'), False))
+    lines.extend(['', 'Top tracebacks:'])
+    lines.extend(_format_diff(after.compare_to(before, 'traceback'), True))
+    return io.StringIO('\n'.join(lines) + '\n')
@@ -0,0 +1,68 @@
+"""Short-lived storage for ordered search results, so that lists can be expanded
+and paged by a compact token in callback data instead of repeating the search."""
+import secrets
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import List
+from raybot.model import Location
+
+
+@dataclass(eq=False)
+class ResultSet:
+    token: str
+    query: str
+    ids: List[int]
+    location: Location = None  # Location used for sorting, if any
+    accessed: float = 0
+
+
+class ResultStore:
+    """Keeps up to max_size result sets, each for ttl seconds after the last access."""
+    def __init__(self, ttl: int = 3600, max_size: int = 2000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.results: OrderedDict[str, ResultSet] = OrderedDict()
+
+    def _evict(self):
+        expired = time.time() - self.ttl
+        while self.results:
+            token, result = next(iter(self.results.items()))
+            if result.accessed >= expired and len(self.results) <= self.max_size:
+                break
+            del self.results[token]
+
+    def put(self, query: str, ids: List[int], location: Location = None) -> str:
+        token = secrets.token_urlsafe(6)
+        while token in self.results:
+            token = secrets.token_urlsafe(6)
+        self.results[token] = ResultSet(token, query, list(ids), location, time.time())
+        self._evict()
+        return token
+
+    def get(self, token: str) -> ResultSet:
+        result = self.results.get(token)
+        if not result or result.accessed < time.time() - self.ttl:
+            return None
+        result.accessed = time.time()
+        self.results.move_to_end(token)
+        return result
+
+    def update(self, token: str, ids: List[int], location: Location = None) -> bool:
+        """Stores a new order for the results. Returns False if the token has expired."""
+        result = self.get(token)
+        if not result:
+            return False
+        result.ids = list(ids)
+        result.location = location
+        return True
+
+
+_store = None
+
+
+def get_result_store() -> ResultStore:
+    global _store
+    if _store is None:
+        _store = ResultStore()
+    return _store
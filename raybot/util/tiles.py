@@ -0,0 +1,199 @@
+import io
+import os
+import sqlite3
+import tempfile
+from PIL import Image
+from typing import List, Iterator, Tuple
+from raybot import config
+
+
+TILE_SIZE = 256
+
+
+class DirectoryTiles:
+    """Tiles in a {z}/{x}/{y}.png directory tree."""
+    def __init__(self, path: str):
+        self.path = path
+
+    def get_zooms(self) -> List[int]:
+        if not os.path.exists(self.path):
+            return []
+        return sorted([int(z) for z in os.listdir(self.path) if z.isdecimal()])
+
+    def get_tile(self, zoom: int, x: int, y: int) -> bytes:
+        path = os.path.join(self.path, str(zoom), str(x), f'{y}.png')
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except IOError:
+            return None
+
+    def iter_tiles(self) -> Iterator[Tuple[int, int, int, str]]:
+        """Yields (zoom, x, y, path) for every tile."""
+        for zoom in self.get_zooms():
+            zdir = os.path.join(self.path, str(zoom))
+            for x in os.listdir(zdir):
+                if not x.isdecimal():
+                    continue
+                for name in os.listdir(os.path.join(zdir, x)):
+                    y, ext = os.path.splitext(name)
+                    if ext == '.png' and y.isdecimal():
+                        yield zoom, int(x), int(y), os.path.join(zdir, x, name)
+
+
+class MBTiles:
+    """Tiles in a single MBTiles file, read through a read-only memory-mapped connection.
+    Note that MBTiles rows are numbered from the bottom (TMS scheme)."""
+    MMAP_SIZE = 256 * 1024 * 1024
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = None
+        self._pid = None
+
+    def get_conn(self) -> sqlite3.Connection:
+        # Connections cannot be shared with forked processes
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(f'file:{self.path}?mode=ro', uri=True,
+                                         check_same_thread=False)
+            self._conn.execute(f'pragma mmap_size = {self.MMAP_SIZE}')
+            self._pid = os.getpid()
+        return self._conn
+
+    def get_zooms(self) -> List[int]:
+        if not os.path.exists(self.path):
+            return []
+        cursor = self.get_conn().execute('select distinct zoom_level from tiles')
+        return sorted([r[0] for r in cursor])
+
+    def get_tile(self, zoom: int, x: int, y: int) -> bytes:
+        cursor = self.get_conn().execute(
+            'select tile_data from tiles where zoom_level = ? and tile_column = ? '
+            'and tile_row = ?', (zoom, x, (1 << zoom) - 1 - y))
+        row = cursor.fetchone()
+        return None if not row else row[0]
+
+
+class SynthesizingTiles:
+    """Wraps a tile store and fills gaps from neighbouring zoom levels:
+    downsamples four children when all are present, otherwise scales up
+    a part of the nearest ancestor. Results are cached in a directory."""
+    def __init__(self, store, cache_dir: str, max_depth: int = 4):
+        self.store = store
+        self.cache = DirectoryTiles(cache_dir)
+        self.max_depth = max_depth
+
+    def get_zooms(self) -> List[int]:
+        return self.store.get_zooms()
+
+    def get_tile(self, zoom: int, x: int, y: int) -> bytes:
+        data = self.store.get_tile(zoom, x, y) or self.cache.get_tile(zoom, x, y)
+        if data:
+            return data
+        image = self.synthesize(zoom, x, y)
+        if not image:
+            return None
+        fp = io.BytesIO()
+        image.save(fp, 'PNG')
+        data = fp.getvalue()
+        self.store_cached(zoom, x, y, data)
+        return data
+
+    def store_cached(self, zoom: int, x: int, y: int, data: bytes):
+        path = os.path.join(self.cache.path, str(zoom), str(x))
+        try:
+            os.makedirs(path, exist_ok=True)
+            # Write atomically, since several processes can synthesize the same tile
+            with tempfile.NamedTemporaryFile(dir=path, suffix='.tmp', delete=False) as f:
+                f.write(data)
+            os.replace(f.name, os.path.join(path, f'{y}.png'))
+        except OSError:
+            pass
+
+    def open_tile(self, zoom: int, x: int, y: int) -> Image.Image:
+        data = self.store.get_tile(zoom, x, y)
+        if not data:
+            return None
+        try:
+            return Image.open(io.BytesIO(data)).convert('RGBA')
+        except IOError:
+            return None
+
+    def synthesize(self, zoom: int, x: int, y: int) -> Image.Image:
+        children = [self.open_tile(zoom + 1, x * 2 + dx, y * 2 + dy)
+                    for dy in (0, 1) for dx in (0, 1)]
+        if all(children):
+            image = Image.new('RGBA', (TILE_SIZE * 2, TILE_SIZE * 2))
+            for i, child in enumerate(children):
+                image.paste(child, ((i % 2) * TILE_SIZE, (i // 2) * TILE_SIZE))
+            return image.resize((TILE_SIZE, TILE_SIZE), Image.LANCZOS)
+
+        for depth in range(1, self.max_depth + 1):
+            if zoom - depth < 0:
+                break
+            parent = self.open_tile(zoom - depth, x >> depth, y >> depth)
+            if parent:
+                size = TILE_SIZE >> depth
+                left = (x - ((x >> depth) << depth)) * size
+                top = (y - ((y >> depth) << depth)) * size
+                part = parent.crop((left, top, left + size, top + size))
+                return part.resize((TILE_SIZE, TILE_SIZE), Image.BICUBIC)
+        return None
+
+
+def is_mbtiles(path: str) -> bool:
+    return bool(path) and (path.endswith('.mbtiles') or os.path.isfile(path))
+
+
+_store = None
+
+
+def get_tile_store():
+    global _store
+    if _store is None:
+        if is_mbtiles(config.TILES):
+            _store = MBTiles(config.TILES)
+        else:
+            _store = DirectoryTiles(config.TILES)
+        if config.TILE_CACHE:
+            _store = SynthesizingTiles(_store, config.TILE_CACHE)
+    return _store
+
+
+def convert_to_mbtiles(source: DirectoryTiles, path: str, bbox: List[float] = None) -> int:
+    """Copies all tiles from a directory tree into a new MBTiles file.
+    Returns the number of tiles written."""
+    if os.path.exists(path):
+        raise FileExistsError(path)
+    zooms = source.get_zooms()
+    conn = sqlite3.connect(path)
+    conn.execute('create table metadata (name text, value text)')
+    conn.execute('create table tiles (zoom_level integer, tile_column integer, '
+                 'tile_row integer, tile_data blob)')
+    conn.execute('create unique index tile_index on tiles (zoom_level, tile_column, tile_row)')
+    metadata = {
+        'name': os.path.splitext(os.path.basename(path))[0],
+        'format': 'png',
+        'type': 'baselayer',
+    }
+    if zooms:
+        metadata['minzoom'] = str(zooms[0])
+        metadata['maxzoom'] = str(zooms[-1])
+    if bbox and len(bbox) == 4:
+        metadata['bounds'] = ','.join(str(c) for c in bbox)
+    conn.executemany('insert into metadata (name, value) values (?, ?)', metadata.items())
+
+    count = 0
+    batch = []
+    for zoom, x, y, tile_path in source.iter_tiles():
+        with open(tile_path, 'rb') as f:
+            batch.append((zoom, x, (1 << zoom) - 1 - y, f.read()))
+        if len(batch) >= 1000:
+            conn.executemany('insert into tiles values (?, ?, ?, ?)', batch)
+            count += len(batch)
+            batch = []
+    conn.executemany('insert into tiles values (?, ?, ?, ?)', batch)
+    count += len(batch)
+    conn.commit()
+    conn.close()
+    return count
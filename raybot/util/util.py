@@ -1,43 +1,19 @@
 from raybot import config
 from raybot.model import db, UserInfo, Location
+from raybot.model.normalize import get_normalizer
 from aiogram import types
 from aiogram.dispatcher import FSMContext
 from aiogram.utils.exceptions import TelegramAPIError, MessageToDeleteNotFound
 from typing import List, Union, Dict, Sequence
-import re
 import time
-import base64
-import struct
 
 
 userdata = {}
 # Markdown requires too much escaping, so we're using HTML
 HTML = types.ParseMode.HTML
-SYNONIMS = {}
 DOW = ['Mo', 'Tu', 'We', 'Th', 'Fr', 'Sa', 'Su']
 
 
-def reverse_synonims():
-    result = {}
-    for k, v in config.RESP['synonims'].items():
-        for s in v:
-            result[s] = k
-    # Add emoji from tags
-    for k, v in config.TAGS['emoji'].items():
-        if k != 'default' and v not in result:
-            kw = config.TAGS['tags'].get(k)
-            if kw:
-                result[v] = kw[0]
-    return result
-
-
-def has_keyword(token, keywords, kwsuffix=''):
-    for k in keywords:
-        if token == k + kwsuffix:
-            return True
-    return False
-
-
 async def get_user(user: types.User):
     info = userdata.get(user.id)
     if not info:
@@ -70,20 +46,8 @@ def forget_user(user_id: int):
         del userdata[user_id]
 
 
-def split_tokens(message, process=True):
-    global SYNONIMS
-    if not SYNONIMS:
-        SYNONIMS = reverse_synonims()
-
-    skip_tokens = set(config.RESP['skip'])
-    s = message.strip().lower().replace('ё', 'е')
-    tokens = re.split(r'[\s,.+=!@#$%^&*()\'"«»<>/?`~|_-]+', s)
-    if process:
-        tokens = [SYNONIMS.get(t, t) for t in tokens
-                  if len(t) > 0 and t not in skip_tokens]
-    else:
-        tokens = [t for t in tokens if len(t) > 0]
-    return tokens
+def split_tokens(message, process=True, stem=True):
+    return get_normalizer().split(message, process, stem)
 
 
 def h(s: str) -> str:
@@ -100,15 +64,6 @@ def get_buttons(rows=None):
     return kbd
 
 
-def pack_ids(ids: Sequence[int]) -> str:
-    return base64.a85encode(struct.pack('h' * len(ids), *ids)).decode()
-
-
-def unpack_ids(s: str) -> List[int]:
-    b = base64.a85decode(s.encode())
-    return list(struct.unpack('h' * (len(b) // 2), b))
-
-
 def uncap(s: str) -> str:
     if not s:
         return s
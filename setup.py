@@ -18,6 +18,7 @@ setup(
         'aiosqlite',
         'pyyaml',
         'pillow',
+        'numpy',
         'astral==1.10.1',
         'lark-parser',
         'babel',